@@ -0,0 +1,319 @@
+"""
+Times ClusterConfig operations and build_config on synthetic large configs.
+
+Each operation is run `--repeat` times and reported with its best and median wall time,
+then run once more under tracemalloc to record its peak memory. The parse and S3 caches
+are cleared before every run, so the numbers are for a cold Lambda invocation.
+
+Usage: python -m benchmarks.suite [--steps N] [--configurations N] [--fleets N]
+                                  [--override-depth N] [--repeat N] [--output FILE]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from unittest.mock import patch
+
+import yaml
+
+from emr_launcher import aws
+from emr_launcher.ClusterConfig import (
+    ClusterConfig,
+    PARSE_CACHE,
+    S3_CONFIG_CACHE,
+    parse_yaml,
+)
+from emr_launcher.handler import build_config
+from emr_launcher.util import CONFIG_TYPES
+
+S3_BUCKET = "emr-launcher-benchmark"
+S3_FOLDER = "configs"
+
+
+def generate_configs(
+    steps: int, configurations: int, fleets: int, override_depth: int
+) -> dict:
+    """Returns synthetic config documents keyed by config type, shaped like the e2e ones."""
+    cluster = {
+        "Name": "emr-launcher-benchmark",
+        "ReleaseLabel": "emr-6.2.0",
+        "Applications": [{"Name": name} for name in ("Spark", "Hive", "HBase")],
+        "Tags": [{"Key": f"tag-{i}", "Value": f"value-{i}"} for i in range(50)],
+    }
+    config_list = [
+        {
+            "Classification": f"classification-{i}",
+            "Properties": {f"property.{i}.{j}": f"value-{j}" for j in range(20)},
+        }
+        for i in range(configurations)
+    ]
+    for classification in ("spark-hive-site", "hive-site"):
+        config_list.append(
+            {
+                "Classification": classification,
+                "Properties": {"javax.jdo.option.ConnectionPassword": "SECRET"},
+            }
+        )
+    instances = {
+        "Ec2SubnetId": "subnet-benchmark",
+        "InstanceFleets": [
+            {
+                "InstanceFleetType": "TASK",
+                "Name": f"fleet-{i}",
+                "TargetOnDemandCapacity": 1,
+                "InstanceTypeConfigs": [
+                    {
+                        "InstanceType": instance_type,
+                        "EbsConfiguration": {
+                            "EbsBlockDeviceConfigs": [
+                                {
+                                    "VolumeSpecification": {
+                                        "SizeInGB": 250,
+                                        "VolumeType": "gp2",
+                                    },
+                                    "VolumesPerInstance": 1,
+                                }
+                            ]
+                        },
+                    }
+                    for instance_type in ("m5.2xlarge", "m5.4xlarge", "r5.2xlarge")
+                ],
+            }
+            for i in range(fleets)
+        ],
+    }
+    step_list = [
+        {
+            "Name": f"step-{i}",
+            "ActionOnFailure": "CONTINUE",
+            "HadoopJarStep": {
+                "Jar": "command-runner.jar",
+                "Args": ["spark-submit", f"s3://bucket/step-{i}.py", "--arg", str(i)],
+            },
+        }
+        for i in range(steps)
+    ]
+    return {
+        "cluster": cluster,
+        "configurations": {"Configurations": config_list},
+        "instances": {"Instances": instances},
+        "steps": {"Steps": step_list},
+        "override": {
+            "Instances": {"Ec2SubnetId": "subnet-override"},
+            **nested_override(override_depth),
+        },
+    }
+
+
+def nested_override(depth: int, leaf: str = "value", breadth: int = 3) -> dict:
+    """Returns an override `depth` levels deep that fans out `breadth` ways at each level."""
+    if depth == 0:
+        return {"leaf": leaf}
+    return {
+        f"level{depth}-{i}": nested_override(depth - 1, leaf, breadth)
+        for i in range(breadth)
+    }
+
+
+def measure(func, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        PARSE_CACHE.invalidate()
+        S3_CONFIG_CACHE.invalidate()
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    PARSE_CACHE.invalidate()
+    S3_CONFIG_CACHE.invalidate()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "peak_memory_kib": round(peak / 1024, 1),
+    }
+
+
+def config_operations(documents: dict, contents: dict, override_depth: int) -> dict:
+    """Returns the ClusterConfig operations to time, each a function taking no arguments."""
+
+    def full_config():
+        config = ClusterConfig({})
+        for config_type in CONFIG_TYPES:
+            config.update(documents[config_type])
+        return config
+
+    base = full_config()
+    steps = base["Steps"]
+    last_step = steps[-1]["Name"] if steps else None
+    paths = ["Instances.Ec2SubnetId", "Instances.InstanceFleets", "Name"] * 1000
+
+    base.override(documents["override"])
+    second_override = nested_override(override_depth, leaf="other-value")
+
+    def deep_merge():
+        # Merges into an existing tree of the same shape, so every level is walked and
+        # every shared node on the way is copied.
+        config = base.derive()
+        config.override(second_override)
+
+    def get_nested_node():
+        for path in paths:
+            base.get_nested_node(path)
+
+    def find_replace():
+        config = base.derive()
+        for step in steps:
+            config.find_replace("Steps", "Name", step["Name"], lambda item: dict(item))
+
+    def extend_nested_list():
+        config = base.derive()
+        for step in steps:
+            config.extend_nested_list("Steps", [step])
+        config.extend_nested_list("BootstrapActions", steps)
+
+    def index_of():
+        config = base.derive()
+        for _ in range(1000):
+            config.index_of("Steps", "Name", last_step)
+
+    def yaml_load():
+        for content in contents.values():
+            parse_yaml(content)
+
+    return {
+        "yaml_load": yaml_load,
+        "deep_merge": deep_merge,
+        "get_nested_node": get_nested_node,
+        "find_replace": find_replace,
+        "extend_nested_list": extend_nested_list,
+        "index_of": index_of,
+    }
+
+
+def build_config_local(config_dir: str, documents: dict, repeat: int) -> dict:
+    with patch.dict(os.environ, {"EMR_LAUNCHER_CONFIG_DIR": config_dir}):
+        return measure(lambda: build_config(override=documents["override"]), repeat)
+
+
+def build_config_s3(contents: dict, documents: dict, repeat: int) -> dict:
+    from moto import mock_s3
+
+    environ = {
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "eu-west-2",
+        "EMR_LAUNCHER_CONFIG_S3_BUCKET": S3_BUCKET,
+        "EMR_LAUNCHER_CONFIG_S3_FOLDER": S3_FOLDER,
+    }
+    with patch.dict(os.environ, environ), mock_s3():
+        os.environ.pop("EMR_LAUNCHER_CONFIG_DIR", None)
+        aws.reset_clients()
+        try:
+            s3 = aws._get_client("s3")
+            s3.create_bucket(
+                Bucket=S3_BUCKET,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+            for config_type, content in contents.items():
+                s3.put_object(
+                    Bucket=S3_BUCKET,
+                    Key=f"{S3_FOLDER}/{config_type}.yaml",
+                    Body=content.encode("utf-8"),
+                )
+            return measure(lambda: build_config(override=documents["override"]), repeat)
+        finally:
+            aws.reset_clients()
+
+
+def run(args) -> dict:
+    documents = generate_configs(
+        args.steps, args.configurations, args.fleets, args.override_depth
+    )
+    contents = {
+        config_type: yaml.safe_dump(documents[config_type])
+        for config_type in CONFIG_TYPES
+    }
+
+    results = {
+        name: measure(func, args.repeat)
+        for name, func in config_operations(
+            documents, contents, args.override_depth
+        ).items()
+    }
+
+    with patch("emr_launcher.handler.sm_retrieve_secrets", return_value="secret"):
+        with tempfile.TemporaryDirectory() as config_dir:
+            for config_type, content in contents.items():
+                with open(os.path.join(config_dir, f"{config_type}.yaml"), "w") as f:
+                    f.write(content)
+            results["build_config_local"] = build_config_local(
+                config_dir, documents, args.repeat
+            )
+
+        try:
+            results["build_config_s3"] = build_config_s3(
+                contents, documents, args.repeat
+            )
+        except ImportError:
+            print("moto is not available, build_config_s3 is skipped")
+
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "libyaml": hasattr(yaml, "CSafeLoader"),
+        "parameters": {
+            "steps": args.steps,
+            "configurations": args.configurations,
+            "fleets": args.fleets,
+            "override_depth": args.override_depth,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--configurations", type=int, default=200)
+    parser.add_argument("--fleets", type=int, default=30)
+    parser.add_argument("--override-depth", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--output", help="write the results as JSON to this file, e.g. to compare runs"
+    )
+    args = parser.parse_args()
+
+    report = run(args)
+
+    print(f"{'operation':<24} {'min':>12} {'median':>12} {'peak memory':>14}")
+    for name, result in report["results"].items():
+        print(
+            f"{name:<24} {result['min_ms']:>10.3f}ms {result['median_ms']:>10.3f}ms"
+            f" {result['peak_memory_kib']:>11.1f}KiB"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares the pure-Python and libyaml YAML loaders on the example and e2e config files.
+
+Usage: python -m benchmarks.yaml_loaders [--repeat N]
+"""
+
+import argparse
+import glob
+import os
+import timeit
+
+import yaml
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_GLOBS = [
+    os.path.join(ROOT_DIR, "docs", "examples", "*.yaml"),
+    os.path.join(ROOT_DIR, "emr_launcher", "tests", "e2e", "*.yaml"),
+]
+LOADERS = {"SafeLoader": yaml.SafeLoader}
+if hasattr(yaml, "CSafeLoader"):
+    LOADERS["CSafeLoader"] = yaml.CSafeLoader
+
+
+def benchmark_file(path: str, repeat: int) -> dict:
+    with open(path, "r") as f:
+        content = f.read()
+
+    results = {}
+    for name, loader in LOADERS.items():
+        timings = timeit.repeat(
+            lambda: yaml.load(content, Loader=loader), number=1, repeat=repeat
+        )
+        results[name] = min(timings)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    if "CSafeLoader" not in LOADERS:
+        print("libyaml is not available, only SafeLoader is measured")
+
+    print(f"{'file':<50} " + " ".join(f"{name:>14}" for name in LOADERS) + "  speedup")
+    for pattern in CONFIG_GLOBS:
+        for path in sorted(glob.glob(pattern)):
+            results = benchmark_file(path, args.repeat)
+            speedup = results["SafeLoader"] / results.get(
+                "CSafeLoader", results["SafeLoader"]
+            )
+            print(
+                f"{os.path.relpath(path, ROOT_DIR):<50} "
+                + " ".join(f"{results[name] * 1000:>12.3f}ms" for name in LOADERS)
+                + f"  {speedup:>6.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,232 @@
+import copy
+import gzip
+import io
+import hashlib
+import json
+import logging
+import os
 from abc import ABC
+from functools import lru_cache
 
-import yaml
 from typing import Callable
 
-from collections.abc import MutableMapping
-from emr_launcher.aws import s3_get_object_body
+from collections.abc import Hashable, MutableMapping
+from emr_launcher.aws import s3_get_object
+from emr_launcher.cache import TTLCache
+
+logger = logging.getLogger("emr_launcher")
+
+
+# Parsed YAML keyed by a hash of its content, so identical bytes are only parsed once.
+PARSE_CACHE = TTLCache(max_size=int(os.getenv("EMR_LAUNCHER_PARSE_CACHE_SIZE", "64")))
+
+# Parsed S3 configs keyed by (bucket, key). Fresh entries are served without a request,
+# stale ones are revalidated with a conditional GET on their ETag.
+S3_CONFIG_CACHE = TTLCache(
+    max_size=int(os.getenv("EMR_LAUNCHER_S3_CONFIG_CACHE_SIZE", "64")),
+    ttl=float(os.getenv("EMR_LAUNCHER_S3_CONFIG_CACHE_TTL", "0")),
+)
+
+
+# Name of the object holding every config type, next to the individual YAML files.
+BUNDLE_KEY = "bundle.json.gz"
+BUNDLE_VERSION = 1
 
 
 class ConfigNotFoundError(Exception):
     pass
 
 
+@lru_cache(maxsize=None)
+def yaml_loader():
+    """
+    Returns libyaml's CSafeLoader when available, which is several times faster than the
+    pure-Python SafeLoader and builds the same tree. yaml is imported on first use.
+    """
+    import yaml
+
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def parse_yaml(content: str):
+    """
+    Parses `content` as YAML, returning a copy of the cached tree if identical content was
+    parsed before in this process.
+    """
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    parsed = PARSE_CACHE.get(digest)
+    if parsed is None:
+        import yaml
+
+        parsed = yaml.load(content, Loader=yaml_loader())
+        PARSE_CACHE.set(digest, parsed)
+    return copy.deepcopy(parsed)
+
+
+def build_bundle(config_dir: str, config_types: list) -> bytes:
+    """
+    Returns a gzipped JSON bundle of the `<config type>.yaml` files found in `config_dir`.
+    The output only depends on the files, so unchanged configs produce an identical bundle.
+    """
+    configs = {}
+    for config_type in config_types:
+        path = os.path.join(config_dir, f"{config_type}.yaml")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                configs[config_type] = parse_yaml(f.read())
+
+    content = json.dumps(
+        {"version": BUNDLE_VERSION, "configs": configs}, sort_keys=True, default=str
+    )
+    # gzip.compress only takes an mtime from Python 3.8.
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode="wb", mtime=0) as f:
+        f.write(content.encode("utf-8"))
+    return output.getvalue()
+
+
+def parse_bundle(content: bytes) -> dict:
+    """Returns the parsed configs held in a bundle, keyed by config type."""
+    bundle = json.loads(gzip.decompress(content))
+    if bundle.get("version") != BUNDLE_VERSION:
+        raise ValueError(
+            "Unsupported config bundle version: %s" % bundle.get("version")
+        )
+    return bundle["configs"]
+
+
+def load_s3_bundle(bucket: str, key: str, s3_client=None):
+    """
+    Returns the configs held in the bundle at `key`, keyed by config type, or None if there is
+    no such object.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        return _load_s3_config(bucket, key, s3_client, parse=parse_bundle, decode=False)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+
+
+def s3_config_etag(
+    bucket: str, key: str, s3_client=None, parse=parse_yaml, decode=True
+):
+    """
+    Returns the ETag of the config at `key`, or None if there is no such object. This goes
+    through the S3 config cache, so it is free while the cached entry is fresh and a
+    conditional GET otherwise.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        return _fetch_s3_config(bucket, key, s3_client, parse, decode)[0]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+
+
+def _load_s3_config(
+    bucket: str, key: str, s3_client=None, parse=parse_yaml, decode=True
+):
+    return copy.deepcopy(_fetch_s3_config(bucket, key, s3_client, parse, decode)[1])
+
+
+def _fetch_s3_config(bucket: str, key: str, s3_client, parse, decode) -> tuple:
+    cache_key = (bucket, key)
+    cached, fresh = S3_CONFIG_CACHE.peek(cache_key)
+
+    if fresh:
+        result = "hits"
+        etag, parsed = cached
+    else:
+        body, etag = s3_get_object(
+            bucket,
+            key,
+            cached[0] if cached is not None else None,
+            s3_client,
+            decode=decode,
+        )
+        if body is None:
+            result = "revalidations"
+            parsed = cached[1]
+            S3_CONFIG_CACHE.set(cache_key, cached)
+        else:
+            result = "misses"
+            parsed = parse(body)
+            if etag is not None:
+                S3_CONFIG_CACHE.set(cache_key, (etag, parsed))
+
+    stats = S3_CONFIG_CACHE.count(result)
+    logger.info(
+        "S3 config cache",
+        extra={"bucket": bucket, "key": key, "result": result, "stats": stats},
+    )
+    return etag, parsed
+
+
+@lru_cache(maxsize=1024)
+def _compile_path(path: str) -> tuple:
+    return tuple(path.split("."))
+
+
 class ClusterConfig(MutableMapping, ABC):
+    """
+    A cluster configuration with copy-on-write semantics. Nested nodes may be shared with the
+    parsed YAML or with configs created by `derive`, so they are never mutated in place: every
+    mutating method first copies the nodes along the path it changes, leaving the rest shared.
+    Nodes returned by reads such as `get_nested_node` must be treated as read-only; use
+    `get_writable_node` to obtain a node that can be changed in place.
+    """
+
     def __init__(self, config: MutableMapping):
         self._config = dict(config)
+        self._owned = {id(self._config): self._config}
+        self._indexes = {}
+
+    def derive(self):
+        """
+        Returns a variant of this config that shares every nested node with it. Either config
+        can then be changed without affecting the other, at the cost of copying only the paths
+        that are actually touched.
+        """
+        self._owned = {id(self._config): self._config}
+        return ClusterConfig(self._config)
+
+    def to_dict(self) -> dict:
+        """Returns the config as a plain dict. Nested nodes are shared and must not be mutated."""
+        return dict(self._config)
+
+    def _own(self, node):
+        if id(node) in self._owned or not isinstance(node, (MutableMapping, list)):
+            return node
+        node = copy.copy(node)
+        self._owned[id(node)] = node
+        return node
+
+    def get_writable_node(self, *keys):
+        """
+        Returns the node reached by following `keys` (mapping keys or list positions), copying
+        any node on the way that is shared with another config, so the returned node can be
+        mutated in place. Raises KeyError, IndexError or TypeError if the path does not exist.
+        """
+        # The caller may change any item under the returned node, e.g. rename a step.
+        self._indexes.clear()
+        node = self._config
+        for key in keys:
+            child = node[key]
+            owned_child = self._own(child)
+            if owned_child is not child:
+                node[key] = owned_child
+            node = owned_child
+        return node
 
     def get_nested_node(self, path: str):
         try:
-            node_keys = path.split(".")
-            current_node = self._config[node_keys.pop(0)]
-            for key in node_keys:
+            current_node = self._config
+            for key in _compile_path(path):
                 current_node = current_node[key]
             return current_node
         except (KeyError, TypeError):
@@ -33,10 +240,57 @@ class ClusterConfig(MutableMapping, ABC):
         if self.get_nested_node(path) is not None:
             raise TypeError(f"Node at path {path} already exists")
 
-        node_keys = path.split(".")
-        key_to_create = node_keys.pop()
-        parent_node = self.get_nested_node(".".join(node_keys))
-        parent_node[key_to_create] = value
+        node_keys = _compile_path(path)
+        try:
+            parent_node = self.get_writable_node(*node_keys[:-1])
+        except (KeyError, TypeError):
+            raise TypeError(f"Parent of node at path {path} does not exist")
+        parent_node[node_keys[-1]] = value
+        self._indexes.clear()
+
+    def _get_list(self, path: str):
+        node = self.get_nested_node(path)
+        if node is not None and not isinstance(node, list):
+            raise TypeError(f"Path {path} does not correspond to a list")
+        return node
+
+    def _build_index(self, path: str, node: list, condition_key: str) -> tuple:
+        positions = {}
+        for position, item in enumerate(node):
+            value = item.get(condition_key)
+            if isinstance(value, Hashable):
+                positions.setdefault(value, position)
+        entry = (node, len(node), positions)
+        self._indexes[(path, condition_key)] = entry
+        return entry
+
+    def index_of(self, path: str, condition_key: str, condition_value):
+        """
+        Returns the position of the first item in the list at `path` whose `condition_key` equals
+        `condition_value`, or None. Indexes are built lazily per (path, key), dropped when the
+        config is mutated through this class, and rebuilt if the list was replaced or resized
+        or a hit no longer matches.
+        """
+        node = self._get_list(path)
+        if node is None:
+            return None
+
+        entry = self._indexes.get((path, condition_key))
+        if entry is None or entry[0] is not node or entry[1] != len(node):
+            entry = self._build_index(path, node, condition_key)
+
+        position = entry[2].get(condition_value)
+        if position is None or node[position].get(condition_key) == condition_value:
+            return position
+        return self._build_index(path, node, condition_key)[2].get(condition_value)
+
+    def find_item(self, path: str, condition_key: str, condition_value):
+        """
+        Returns the first item in the list at `path` (of the form NAME_1.NAME_2) with the attribute
+        `condition_key` equal to `condition_value`, or None if there is no such item.
+        """
+        position = self.index_of(path, condition_key, condition_value)
+        return None if position is None else self.get_nested_node(path)[position]
 
     def find_replace(
         self,
@@ -48,25 +302,41 @@ class ClusterConfig(MutableMapping, ABC):
         """
         Finds a node in the list at the specified `path`(of the form NAME_1.NAME_2), with the attribute
         `condition_key` equal to `condition_value`, and replaces it with the return value of `replace_func`.
-        `replace_func` must return a value.
+        `replace_func` must return a value and must not mutate the node it is given.
         """
-        node = self.get_nested_node(path)
-        if node is None:
+        position = self.index_of(path, condition_key, condition_value)
+        if position is None:
             return
 
-        if not isinstance(node, list):
-            raise TypeError(f"Path {path} does not correspond to a list")
+        node = self.get_writable_node(*_compile_path(path))
+        replaced_item = replace_func(node[position])
+        if replaced_item is None:
+            raise TypeError("Replacement function must return replacement value")
+        node[position] = replaced_item
+        self._indexes.pop((path, condition_key), None)
 
-        found_item = next(
-            (item for item in node if item[condition_key] == condition_value), None
-        )
+    def find_replace_all(
+        self, path: str, condition_key: str, replace_funcs: MutableMapping
+    ):
+        """
+        Replaces, in a single pass over the list at `path`, every item whose `condition_key` is a
+        key of `replace_funcs` with the return value of the matching function. As with
+        `find_replace`, the functions must not mutate the nodes they are given.
+        """
+        node = self._get_list(path)
+        if node is None:
+            return
 
-        if found_item is not None:
-            replaced_item = replace_func(found_item)
+        node = self.get_writable_node(*_compile_path(path))
+        for position, item in enumerate(node):
+            replace_func = replace_funcs.get(item.get(condition_key))
+            if replace_func is None:
+                continue
+            replaced_item = replace_func(item)
             if replaced_item is None:
                 raise TypeError("Replacement function must return replacement value")
-            found_item_index = node.index(found_item)
-            node[found_item_index] = replaced_item
+            node[position] = replaced_item
+        self._indexes.clear()
 
     def _deep_merge(self, node: MutableMapping, other: MutableMapping):
         for key in other:
@@ -74,6 +344,7 @@ class ClusterConfig(MutableMapping, ABC):
                 if isinstance(node[key], MutableMapping) and isinstance(
                     other[key], MutableMapping
                 ):
+                    node[key] = self._own(node[key])
                     self._deep_merge(node[key], other[key])
                 elif node[key] == other[key]:
                     pass  # same leaf value
@@ -88,6 +359,7 @@ class ClusterConfig(MutableMapping, ABC):
         Nested lists are not merged but replaced altogether.
         """
         self._deep_merge(self._config, other)
+        self._indexes.clear()
 
     def extend_nested_list(self, path: str, items: list):
         """
@@ -101,14 +373,29 @@ class ClusterConfig(MutableMapping, ABC):
         elif not isinstance(node, list):
             raise TypeError(f"Node at path {path} is not of type list")
         else:
-            node.extend(items)
+            self.get_writable_node(*_compile_path(path)).extend(items)
+        self._indexes.clear()
+
+    def merge_tags(self, tags: dict):
+        """
+        Merges `tags` (a mapping of tag key to value) into the `Tags` list of this config, so
+        they are applied by `run_job_flow` itself. Values in `tags` replace existing tags with
+        the same key and every key appears only once.
+        """
+        if not tags:
+            return
+
+        merged = {tag["Key"]: tag["Value"] for tag in self._config.get("Tags") or []}
+        merged.update(tags)
+        self._config["Tags"] = [
+            {"Key": key, "Value": value} for key, value in merged.items()
+        ]
+        self._indexes.clear()
 
     @classmethod
     def from_s3(cls, bucket: str, key: str, s3_client=None):
         try:
-            return ClusterConfig(
-                yaml.safe_load(s3_get_object_body(bucket, key, s3_client))
-            )
+            return ClusterConfig(_load_s3_config(bucket, key, s3_client))
         except Exception as e:
             raise ConfigNotFoundError(e)
 
@@ -116,7 +403,7 @@ class ClusterConfig(MutableMapping, ABC):
     def from_local(cls, file_path: str):
         try:
             with open(file_path, "r") as file:
-                return ClusterConfig(yaml.safe_load(file.read()))
+                return ClusterConfig(parse_yaml(file.read()))
         except FileNotFoundError:
             raise ConfigNotFoundError
 
@@ -132,9 +419,11 @@ class ClusterConfig(MutableMapping, ABC):
 
     def __setitem__(self, key, value):
         self._config[key] = value
+        self._indexes.clear()
 
     def __delitem__(self, key):
         del self._config[key]
+        self._indexes.clear()
 
     def __str__(self):
         return self._config.__str__()
@@ -1,8 +1,85 @@
+import argparse
+import json
+import os
+
 from emr_launcher.logger import configure_log
 from emr_launcher.handler import handler
 
+parser = argparse.ArgumentParser(
+    prog="python -m emr_launcher",
+    description="Launches an EMR cluster from YAML configuration files.",
+)
+parser.add_argument(
+    "--event",
+    help="path to a JSON file holding the event to pass to the handler",
+)
+parser.add_argument(
+    "--plan",
+    action="store_true",
+    help="print the RunJobFlow request and per-phase timings instead of launching",
+)
+subparsers = parser.add_subparsers(dest="command")
+bundle_parser = subparsers.add_parser(
+    "bundle",
+    help="build a config bundle from a directory of YAML configuration files",
+)
+bundle_parser.add_argument(
+    "config_dir", help="directory holding cluster.yaml, instances.yaml etc."
+)
+bundle_parser.add_argument(
+    "--output", help="path of the bundle to write (default <config_dir>/bundle.json.gz)"
+)
+cleanup_parser = subparsers.add_parser(
+    "cleanup-secconfigs",
+    help="delete duplicated security configurations no active cluster uses",
+)
+cleanup_parser.add_argument(
+    "--source",
+    required=True,
+    help="the security configuration whose duplicates are cleaned up",
+)
+cleanup_parser.add_argument(
+    "--min-age-hours",
+    type=float,
+    default=24,
+    help="only delete duplicates created at least this long ago (default 24)",
+)
+cleanup_parser.add_argument(
+    "--dry-run", action="store_true", help="list the duplicates without deleting them"
+)
+args = parser.parse_args()
+
+if args.command == "bundle":
+    from emr_launcher.ClusterConfig import BUNDLE_KEY, build_bundle
+    from emr_launcher.util import CONFIG_TYPES
+
+    output = args.output or os.path.join(args.config_dir, BUNDLE_KEY)
+    with open(output, "wb") as f:
+        f.write(build_bundle(args.config_dir, CONFIG_TYPES))
+    print(f"Config bundle written to {output}")
+    raise SystemExit(0)
+
+if args.command == "cleanup-secconfigs":
+    from emr_launcher.aws import cleanup_security_configurations
+
+    configure_log()
+    for name in cleanup_security_configurations(
+        args.source, args.min_age_hours * 3600, dry_run=args.dry_run
+    ):
+        print(name)
+    raise SystemExit(0)
+
+event = {}
+if args.event:
+    with open(args.event, "r") as f:
+        event = json.load(f)
+if args.plan:
+    event["plan"] = True
+
 logger = configure_log()
 try:
-    handler()
+    response = handler(event)
+    if args.plan:
+        print(json.dumps(response, indent=2, default=str))
 except Exception as e:
     logger.error(e)
@@ -1,46 +1,419 @@
+import hashlib
 import logging
-import ast
+import os
+import random
+import re
+import threading
+import time
 
-import boto3
+from functools import lru_cache
 
-from emr_launcher.logger import configure_log
-from datetime import datetime
+from emr_launcher.cache import TTLCache, SingleFlight
+from emr_launcher.logger import LogPayload
+from datetime import datetime, timedelta, timezone
 
-logger = configure_log()
+# boto3, botocore and ast are imported on first use to keep cold starts short.
+logger = logging.getLogger("emr_launcher")
 
+# Per-service botocore settings for pooled clients. Services not listed here use
+# the defaults.
+CLIENT_CONFIGS = {
+    "s3": {
+        "max_pool_connections": 20,
+        "connect_timeout": 5,
+        "read_timeout": 30,
+        "tcp_keepalive": True,
+    },
+    "secretsmanager": {
+        "max_pool_connections": 10,
+        "connect_timeout": 5,
+        "read_timeout": 10,
+        "tcp_keepalive": True,
+    },
+    "emr": {
+        "max_pool_connections": 10,
+        "connect_timeout": 5,
+        "read_timeout": 60,
+        "tcp_keepalive": True,
+        # Retries are made by _call_emr_api, so that throttling also slows down the rate
+        # limiter; botocore's own retries would hide it.
+        "retries": {"mode": "standard", "max_attempts": 1},
+    },
+}
+DEFAULT_CLIENT_CONFIG = {
+    "max_pool_connections": 10,
+    "connect_timeout": 10,
+    "read_timeout": 60,
+    "tcp_keepalive": True,
+}
 
-def _get_client(service_name: str):
-    session = boto3.session.Session()
-    return session.client(service_name=service_name)
+# Secret values are only ever held in memory, keyed by secret name, and are never logged.
+SECRETS_CACHE = TTLCache(
+    max_size=int(os.getenv("EMR_LAUNCHER_SECRETS_CACHE_SIZE", "32")),
+    ttl=float(os.getenv("EMR_LAUNCHER_SECRETS_CACHE_TTL", "300")),
+)
+_secrets_in_flight = SingleFlight()
+
+# Descriptions of WAITING clusters keyed by cluster name, used to find clusters to reuse.
+WAITING_CLUSTERS_CACHE = TTLCache(
+    max_size=16, ttl=float(os.getenv("EMR_LAUNCHER_REUSE_CACHE_TTL", "30"))
+)
+
+# Errors returned by AWS when a request is rejected because of request rate limits.
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+}
+# Errors returned by AWS when it failed to handle a request that may succeed if retried.
+TRANSIENT_ERROR_CODES = {
+    "InternalError",
+    "InternalFailure",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+DEFAULT_EMR_API_RATE = 5.0
+DEFAULT_EMR_API_BURST = 10
+DEFAULT_EMR_MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+# Duplicated security configurations are named <source>_<first 16 hex digits of the
+# SHA-256 of their content>. Older duplicates were named <source>_<YYYYmmddHHMMSS>.
+DUPLICATE_DIGEST_LENGTH = 16
+DUPLICATE_NAME_PATTERN = re.compile(
+    r"^(?P<source>.+)_(?:(?P<digest>[0-9a-f]{16})|(?P<timestamp>\d{14}))$"
+)
+ACTIVE_CLUSTER_STATES = [
+    "STARTING",
+    "BOOTSTRAPPING",
+    "RUNNING",
+    "WAITING",
+    "TERMINATING",
+]
+
+# Duplicated security configurations known to exist, keyed by their name, which is that of
+# their source and a hash of its content.
+SECURITY_CONFIGS_CACHE = TTLCache(
+    max_size=32, ttl=float(os.getenv("EMR_LAUNCHER_SECCONFIG_CACHE_TTL", "300"))
+)
+
+_session = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        with _clients_lock:
+            if _session is None:
+                import boto3
+
+                _session = boto3.session.Session()
+    return _session
+
+
+def _credentials_key(session):
+    credentials = session.get_credentials()
+    if credentials is None:
+        return None
+    return credentials.access_key
+
+
+def _get_client(service_name: str, region_name: str = None):
+    """
+    Returns a client for `service_name` from the process-wide pool, creating it on first use.
+    Clients are keyed by service, region and credentials so they survive across warm
+    invocations but are never shared between different credentials.
+    """
+    session = _get_session()
+    region_name = region_name or session.region_name
+    key = (service_name, region_name, _credentials_key(session))
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    from botocore.config import Config
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            for stale_key in [k for k in _clients if k[:2] == key[:2]]:
+                del _clients[stale_key]
+            client = session.client(
+                service_name=service_name,
+                region_name=region_name,
+                config=Config(
+                    **CLIENT_CONFIGS.get(service_name, DEFAULT_CLIENT_CONFIG)
+                ),
+            )
+            _clients[key] = client
+    return client
+
+
+def reset_clients():
+    """Drops the session and all pooled clients, e.g. when credentials have expired."""
+    global _session
+    with _clients_lock:
+        _clients.clear()
+        _session = None
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average and bursts of up to `capacity` calls. The rate
+    is halved whenever the API throttles us and recovers gradually as calls succeed again.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Takes a token, sleeping until one is available. Returns the seconds slept."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def _get_rate_limiter(operation_name: str) -> TokenBucket:
+    limiter = _rate_limiters.get(operation_name)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.setdefault(
+                operation_name,
+                TokenBucket(
+                    rate=float(
+                        os.getenv("EMR_LAUNCHER_EMR_API_RATE", DEFAULT_EMR_API_RATE)
+                    ),
+                    capacity=int(
+                        os.getenv("EMR_LAUNCHER_EMR_API_BURST", DEFAULT_EMR_API_BURST)
+                    ),
+                ),
+            )
+    return limiter
+
+
+def reset_rate_limiters():
+    """Drops every rate limiter, so they are recreated from the environment on next use."""
+    with _rate_limiters_lock:
+        _rate_limiters.clear()
+
+
+def _retry_reason(error) -> str:
+    """Returns `throttled` or `transient` if `error` is worth retrying, otherwise None."""
+    from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+    if isinstance(error, ClientError):
+        details = error.response.get("Error", {})
+        if details.get("Code") in THROTTLING_ERROR_CODES:
+            return "throttled"
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        if details.get("Code") in TRANSIENT_ERROR_CODES or status >= 500:
+            return "transient"
+    elif isinstance(error, (ConnectionError, HTTPClientError)):
+        return "transient"
+    return None
+
+
+def _call_emr_api(emr_client, operation_name: str, **kwargs):
+    """
+    Calls `operation_name` on `emr_client` once a token is available from that operation's
+    rate limiter. Throttling, 5xx and connection errors are retried up to
+    EMR_LAUNCHER_EMR_MAX_ATTEMPTS times with exponential backoff and full jitter, and
+    throttling also slows down the rate limiter; any other error is raised straight away.
+    """
+    limiter = _get_rate_limiter(operation_name)
+    max_attempts = int(
+        os.getenv("EMR_LAUNCHER_EMR_MAX_ATTEMPTS", DEFAULT_EMR_MAX_ATTEMPTS)
+    )
+    attempts = 0
+    waited = 0.0
+    while True:
+        attempts += 1
+        waited += limiter.acquire()
+        try:
+            response = getattr(emr_client, operation_name)(**kwargs)
+        except Exception as e:
+            reason = _retry_reason(e)
+            if reason is None:
+                raise
+            if reason == "throttled":
+                limiter.throttled()
+            if attempts >= max_attempts:
+                logger.warning(
+                    "EMR API call still failing, giving up",
+                    extra={
+                        "operation": operation_name,
+                        "reason": reason,
+                        "attempts": attempts,
+                        "wait_seconds": round(waited, 3),
+                    },
+                )
+                raise
+            delay = random.uniform(
+                0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+            )
+            time.sleep(delay)
+            waited += delay
+            continue
+
+        limiter.succeeded()
+        logger.log(
+            logging.INFO if attempts > 1 or waited else logging.DEBUG,
+            "EMR API call",
+            extra={
+                "operation": operation_name,
+                "attempts": attempts,
+                "wait_seconds": round(waited, 3),
+            },
+        )
+        return response
+
+
+def _sm_fetch_secret(secret_name, sm_client=None):
+    import ast
+
+    if sm_client is None:
+        sm_client = _get_client(service_name="secretsmanager")
+    response = sm_client.get_secret_value(SecretId=secret_name)
+    response_string = response["SecretString"]
+    response_dict = ast.literal_eval(response_string)
+    secret_value = response_dict["password"]
+
+    SECRETS_CACHE.set(secret_name, secret_value)
+    return secret_value
 
 
 def sm_retrieve_secrets(secret_name, sm_client=None):
-    try:
-        if sm_client is None:
-            sm_client = _get_client(service_name="secretsmanager")
-        response = sm_client.get_secret_value(SecretId=secret_name)
-        response_string = response["SecretString"]
-        response_dict = ast.literal_eval(response_string)
-        secret_value = response_dict["password"]
+    """
+    Returns the password held in `secret_name`. Values are cached for
+    EMR_LAUNCHER_SECRETS_CACHE_TTL seconds and concurrent lookups of the same secret share
+    a single Secrets Manager call.
+    """
+    secret_value = SECRETS_CACHE.get(secret_name)
+    if secret_value is not None:
+        logger.debug(
+            "Secret served from cache",
+            extra={"secret_name": secret_name, "stats": SECRETS_CACHE.count("hits")},
+        )
+        return secret_value
 
+    try:
+        secret_value = _secrets_in_flight.do(
+            secret_name, lambda: _sm_fetch_secret(secret_name, sm_client)
+        )
+        logger.debug(
+            "Secret retrieved from secretsmanager",
+            extra={"secret_name": secret_name, "stats": SECRETS_CACHE.count("misses")},
+        )
         return secret_value
     except Exception:
         logging.info(secret_name + " Secret not found in secretsmanager")
 
 
+def invalidate_secrets(secret_name=None):
+    """Drops `secret_name` from the secrets cache, or every cached secret if no name is given."""
+    SECRETS_CACHE.invalidate(secret_name)
+
+
 def s3_get_object_body(bucket, key, s3_client=None):
+    return s3_get_object(bucket, key, s3_client=s3_client)[0]
+
+
+def s3_get_object(bucket, key, etag=None, s3_client=None, decode=True):
+    """
+    Returns a tuple of (body, etag) for the S3 object, the body being decoded as UTF-8 unless
+    `decode` is False. When `etag` is provided the GET is conditional on the object having
+    changed; if it has not, (None, etag) is returned.
+    """
+    from botocore.exceptions import ClientError
+
     if s3_client is None:
         s3_client = _get_client(service_name="s3")
-    response = s3_client.get_object(Bucket=bucket, Key=key)
-    return response["Body"].read().decode("utf8")
+
+    params = {"Bucket": bucket, "Key": key}
+    if etag is not None:
+        params["IfNoneMatch"] = etag
+    try:
+        response = s3_client.get_object(**params)
+    except ClientError as e:
+        status_code = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if etag is not None and status_code == 304:
+            return None, etag
+        raise
+    body = response["Body"].read()
+    return body.decode("utf8") if decode else body, response.get("ETag")
+
+
+@lru_cache(maxsize=None)
+def _run_job_flow_validator():
+    from botocore.loaders import create_loader
+    from botocore.model import ServiceModel
+    from botocore.validate import ParamValidator
+
+    service_model = ServiceModel(
+        create_loader().load_service_model("emr", "service-2"), service_name="emr"
+    )
+    return ParamValidator(), service_model.operation_model("RunJobFlow").input_shape
+
+
+def validate_run_job_flow_request(config):
+    """
+    Validates `config` against the RunJobFlow input shape of the botocore EMR model, raising
+    botocore's ParamValidationError with a report of every problem found. The model is
+    loaded once per process.
+    """
+    from botocore.exceptions import ParamValidationError
+
+    validator, input_shape = _run_job_flow_validator()
+    report = validator.validate(config, input_shape)
+    if report.has_errors():
+        raise ParamValidationError(report=report.generate_report())
 
 
 def emr_launch_cluster(config, emr_client=None):
     if emr_client is None:
         emr_client = _get_client(service_name="emr")
     logger.info("Launching EMR cluster")
-    logger.debug("EMR cluster config", extra=config)
-    resp = emr_client.run_job_flow(**config)
+    logger.debug("EMR cluster config %s", LogPayload(config))
+    resp = _call_emr_api(emr_client, "run_job_flow", **config)
     logger.info("Cluster submission successful")
     return resp
 
@@ -49,29 +422,232 @@ def emr_cluster_add_tags(job_flow_id, tags, emr_client=None):
     if emr_client is None:
         emr_client = _get_client(service_name="emr")
 
+    if not tags:
+        return
+
     logger.info("Adding additional tags to cluster")
-    for key, value in tags.items():
-        response = emr_client.add_tags(
-            ResourceId=job_flow_id,
-            Tags=[
-                {"Key": key, "Value": value},
-            ],
-        )
-        logger.debug(response)
+    response = _call_emr_api(
+        emr_client,
+        "add_tags",
+        ResourceId=job_flow_id,
+        Tags=[{"Key": key, "Value": value} for key, value in tags.items()],
+    )
+    logger.debug(response)
     logger.info("Successfully added additional tags")
 
 
-def dup_security_configuration(source_config, emr_client=None):
+def emr_describe_waiting_clusters(name, emr_client=None):
+    """
+    Returns the `describe_cluster` descriptions of every WAITING cluster called `name`. Results
+    are cached for EMR_LAUNCHER_REUSE_CACHE_TTL seconds.
+    """
+    clusters = WAITING_CLUSTERS_CACHE.get(name)
+    if clusters is not None:
+        return clusters
+
     if emr_client is None:
         emr_client = _get_client(service_name="emr")
 
-    logger.info("Duplicating security configuration " + source_config)
-    json_config = emr_client.describe_security_configuration(Name=source_config)
+    cluster_ids = []
+    params = {"ClusterStates": ["WAITING"]}
+    while True:
+        response = _call_emr_api(emr_client, "list_clusters", **params)
+        cluster_ids.extend(
+            cluster["Id"] for cluster in response["Clusters"] if cluster["Name"] == name
+        )
+        if not response.get("Marker"):
+            break
+        params["Marker"] = response["Marker"]
+
+    clusters = [
+        _call_emr_api(emr_client, "describe_cluster", ClusterId=cluster_id)["Cluster"]
+        for cluster_id in cluster_ids
+    ]
+    WAITING_CLUSTERS_CACHE.set(name, clusters)
+    return clusters
+
+
+def invalidate_waiting_clusters(name=None):
+    """Drops the cached WAITING clusters called `name`, or all of them if no name is given."""
+    WAITING_CLUSTERS_CACHE.invalidate(name)
 
-    new_config = source_config + datetime.now().strftime("_%Y%m%d%H%M%S")
-    emr_client.create_security_configuration(
-        Name=new_config, SecurityConfiguration=json_config["SecurityConfiguration"]
+
+def emr_add_job_flow_steps(job_flow_id, steps, emr_client=None):
+    if emr_client is None:
+        emr_client = _get_client(service_name="emr")
+
+    logger.info("Submitting steps to cluster", extra={"job_flow_id": job_flow_id})
+    logger.debug("EMR steps %s", LogPayload(steps))
+    return _call_emr_api(
+        emr_client, "add_job_flow_steps", JobFlowId=job_flow_id, Steps=steps
+    )
+
+
+def _is_already_exists_error(error) -> bool:
+    details = error.response.get("Error", {})
+    return details.get("Code") == "InvalidRequestException" and (
+        "already exists" in details.get("Message", "")
     )
 
-    logger.info("Duplicating security configuration successful")
+
+def _is_not_found_error(error) -> bool:
+    details = error.response.get("Error", {})
+    return details.get("Code") == "InvalidRequestException" and (
+        "does not exist" in details.get("Message", "")
+    )
+
+
+def security_configuration_duplicate_name(source_config, security_configuration):
+    """Returns the name of the duplicate of `source_config` with the given content."""
+    digest = hashlib.sha256(security_configuration.encode("utf-8")).hexdigest()
+    return f"{source_config}_{digest[:DUPLICATE_DIGEST_LENGTH]}"
+
+
+def emr_describe_security_configuration(name, emr_client=None) -> str:
+    """Returns the content of the security configuration `name`."""
+    if emr_client is None:
+        emr_client = _get_client(service_name="emr")
+    return _call_emr_api(emr_client, "describe_security_configuration", Name=name)[
+        "SecurityConfiguration"
+    ]
+
+
+def dup_security_configuration(
+    source_config, emr_client=None, dry_run=False, content=None
+):
+    """
+    Returns the name of a copy of the security configuration `source_config`. The copy is
+    named after a hash of its content, so an existing copy with the same content is reused
+    rather than a new one created. Copies are cached per process, by source and content
+    hash, for EMR_LAUNCHER_SECCONFIG_CACHE_TTL seconds, and a cached copy that no longer
+    exists is made again. `content` is that of `source_config` if it was already
+    described. With `dry_run` nothing is created.
+    """
+    from botocore.exceptions import ClientError
+
+    if emr_client is None:
+        emr_client = _get_client(service_name="emr")
+
+    # The source is described on every call, so an edit to it is copied on the next launch.
+    if content is None:
+        content = emr_describe_security_configuration(source_config, emr_client)
+    new_config = security_configuration_duplicate_name(source_config, content)
+
+    if SECURITY_CONFIGS_CACHE.get(new_config) is not None:
+        # The copy may have been deleted since by a cleanup in another process.
+        try:
+            _call_emr_api(
+                emr_client, "describe_security_configuration", Name=new_config
+            )
+            logger.info("Reusing security configuration " + new_config)
+            return new_config
+        except ClientError as e:
+            if not _is_not_found_error(e):
+                raise
+            logger.info("Security configuration deleted, copying again " + new_config)
+            SECURITY_CONFIGS_CACHE.invalidate(new_config)
+
+    logger.info("Duplicating security configuration " + source_config)
+    if dry_run:
+        logger.info("Dry run, not creating security configuration " + new_config)
+        return new_config
+
+    try:
+        _call_emr_api(
+            emr_client,
+            "create_security_configuration",
+            Name=new_config,
+            SecurityConfiguration=content,
+        )
+        logger.info("Duplicating security configuration successful")
+    except ClientError as e:
+        if not _is_already_exists_error(e):
+            raise
+        logger.info("Reusing security configuration " + new_config)
+
+    SECURITY_CONFIGS_CACHE.set(new_config, new_config)
     return new_config
+
+
+def _is_content_hashed_copy(emr_client, name) -> bool:
+    """Returns whether `name` ends with the hash of its content, like copies made here."""
+    content = _call_emr_api(emr_client, "describe_security_configuration", Name=name)[
+        "SecurityConfiguration"
+    ]
+    source_config = DUPLICATE_NAME_PATTERN.match(name).group("source")
+    return security_configuration_duplicate_name(source_config, content) == name
+
+
+def cleanup_security_configurations(
+    source_config, min_age_seconds=86400, emr_client=None, dry_run=False
+):
+    """
+    Deletes duplicates of `source_config` made by `dup_security_configuration`, both
+    content-hashed and older timestamped ones, that were created more than
+    `min_age_seconds` ago and are not used by any cluster that is still active. The copy of
+    the source's current content is always kept, as the next launch would reuse it. A
+    content-hashed name is only deleted if its suffix is the hash of its own content, as it
+    is for every copy made by the launcher. Returns the names of the deleted (or, with
+    `dry_run`, deletable) duplicates.
+    """
+    from botocore.exceptions import ClientError
+
+    if not source_config:
+        raise ValueError("The source security configuration must be given")
+    if emr_client is None:
+        emr_client = _get_client(service_name="emr")
+
+    try:
+        current = security_configuration_duplicate_name(
+            source_config,
+            emr_describe_security_configuration(source_config, emr_client),
+        )
+    except ClientError as e:
+        if not _is_not_found_error(e):
+            raise
+        current = None
+
+    in_use = set()
+    params = {"ClusterStates": ACTIVE_CLUSTER_STATES}
+    while True:
+        response = _call_emr_api(emr_client, "list_clusters", **params)
+        for cluster in response["Clusters"]:
+            description = _call_emr_api(
+                emr_client, "describe_cluster", ClusterId=cluster["Id"]
+            )["Cluster"]
+            if description.get("SecurityConfiguration"):
+                in_use.add(description["SecurityConfiguration"])
+        if not response.get("Marker"):
+            break
+        params["Marker"] = response["Marker"]
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age_seconds)
+    stale = []
+    params = {}
+    while True:
+        response = _call_emr_api(emr_client, "list_security_configurations", **params)
+        for security_configuration in response["SecurityConfigurations"]:
+            name = security_configuration["Name"]
+            match = DUPLICATE_NAME_PATTERN.match(name)
+            if match is None or name in in_use or name == current:
+                continue
+            if match.group("source") != source_config:
+                continue
+            if security_configuration["CreationDateTime"] > cutoff:
+                continue
+            if match.group("digest") and not _is_content_hashed_copy(emr_client, name):
+                continue
+            stale.append(name)
+        if not response.get("Marker"):
+            break
+        params = {"Marker": response["Marker"]}
+
+    for name in stale:
+        if dry_run:
+            logger.info("Dry run, not deleting security configuration " + name)
+            continue
+        _call_emr_api(emr_client, "delete_security_configuration", Name=name)
+        logger.info("Deleted security configuration " + name)
+
+    SECURITY_CONFIGS_CACHE.invalidate()
+    return stale
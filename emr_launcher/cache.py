@@ -0,0 +1,99 @@
+import threading
+import time
+
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from typing import Callable
+
+
+class TTLCache:
+    """
+    Thread-safe, size-bounded LRU cache whose entries go stale `ttl` seconds after they were
+    stored. A `ttl` of None means entries never go stale. Stale entries are kept (until evicted)
+    so callers can revalidate them rather than fetch from scratch.
+    """
+
+    def __init__(self, max_size: int = 128, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """Returns a tuple of (value, is_fresh), or (None, False) if `key` is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            self._entries.move_to_end(key)
+            value, stored_at = entry
+            return value, self.ttl is None or time.monotonic() - stored_at < self.ttl
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key` if it is fresh, otherwise `default`."""
+        value, fresh = self.peek(key)
+        return value if fresh else default
+
+    def set(self, key, value):
+        """Stores `value` under `key`, evicting the least recently used entries over `max_size`."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Removes `key` from the cache, or every entry if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def count(self, event: str) -> dict:
+        """Increments the `event` counter and returns a snapshot of all counters."""
+        with self._lock:
+            self.stats[event] += 1
+            return dict(self.stats)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into a single in-flight call. Callers that
+    arrive while a call is running wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self._calls[key] = call
+
+        if not leader:
+            return call.result()
+
+        try:
+            call.set_result(func())
+        except BaseException as e:
+            call.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return call.result()
@@ -1,22 +1,57 @@
 #!/usr/bin/env python
 
+import functools
+import hashlib
 import json
+import logging
+import os
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from emr_launcher.ClusterConfig import ClusterConfig
 from emr_launcher.aws import (
     sm_retrieve_secrets,
     emr_launch_cluster,
     emr_cluster_add_tags,
+    emr_add_job_flow_steps,
+    invalidate_waiting_clusters,
     dup_security_configuration,
+    emr_describe_security_configuration,
+    validate_run_job_flow_request,
 )
-from emr_launcher.logger import configure_log
+from emr_launcher.idempotency import (
+    idempotent_launch,
+    payload_key,
+    correlation_id_key,
+)
+from emr_launcher.logger import configure_log, flushes_log, LogPayload, redact
+from emr_launcher.metrics import metrics_timer, emit_phase_metrics
+from emr_launcher.pipeline import Pipeline, LaunchContext
+from emr_launcher.reuse import (
+    reuse_enabled,
+    find_reusable_cluster,
+    reuse_count,
+    ignored_tags,
+    launch_fingerprint,
+    release_cluster,
+    REUSE_COUNT_TAG,
+    FINGERPRINT_TAG,
+)
+from emr_launcher.timing import PhaseTimer, NULL_TIMER
+from emr_launcher.cache import TTLCache, SingleFlight
 from emr_launcher.util import (
     read_config,
+    read_configs,
+    bundle_enabled,
+    CONFIG_TYPES,
+    OPTIONAL_CONFIG_TYPES,
+    config_fingerprint,
     deprecated,
+    get_config_source,
     get_payload,
     Payload,
+    FanOutParameters,
     add_command_line_params,
 )
 
@@ -34,70 +69,317 @@ PAYLOAD_CORRELATION_ID = "correlation_id"
 PAYLOAD_SNAPSHOT_TYPE = "snapshot_type"
 PAYLOAD_EXPORT_DATE = "export_date"
 PAYLOAD_SKIP_PDM_TRIGGER = "skip_pdm_trigger"
+PAYLOAD_FAN_OUT = "fan_out"
 
 ADG_NAME = "analytical-dataset-generator"
 
 SNAPSHOT_TYPE_FULL = "full"
 SNAPSHOT_TYPE_INCREMENTAL = "incremental"
 
+DEFAULT_SQS_BATCH_WORKERS = 4
+DEFAULT_FAN_OUT_WORKERS = 4
+
+# Fields of a fan-out parameter set that are appended to the args of every step.
+FAN_OUT_STEP_ARGS = ("correlation_id", "s3_bucket_name", "s3_prefix", "export_date")
+
+# Resolved base configs for S3 event launches, keyed by config location. Each entry holds
+# the fingerprint of the config files and digests of the secret values it was built from.
+BASE_CONFIG_CACHE = TTLCache(
+    max_size=int(os.getenv("EMR_LAUNCHER_BASE_CONFIG_CACHE_SIZE", "4"))
+)
+_base_config_in_flight = SingleFlight()
+
+
+PIPELINE = Pipeline()
+
+HIVE_SITE_CLASSIFICATIONS = ("spark-hive-site", "hive-site")
+CONNECTION_PASSWORD = "javax.jdo.option.ConnectionPassword"
+
+
+@PIPELINE.stage("config_load", base=True)
+def load_stage(cluster_config, context: LaunchContext) -> ClusterConfig:
+    return _merge_configs(read_configs(s3_overrides=context.s3_overrides))
+
+
+def _merge_configs(configs: dict) -> ClusterConfig:
+    cluster_config = configs["cluster"]
+    cluster_config.update(configs["configurations"])
+    cluster_config.update(configs["instances"])
+    cluster_config.update(configs["steps"])
+    return cluster_config
+
+
+@PIPELINE.stage("secrets", base=True)
+def secrets_stage(cluster_config: ClusterConfig, context: LaunchContext):
+    return _resolve_secrets(cluster_config, context, sm_retrieve_secrets)
+
+
+def _resolve_secrets(
+    cluster_config: ClusterConfig, context: LaunchContext, retrieve_secret
+) -> ClusterConfig:
+    """
+    Replaces the metastore password of the hive classifications by its secret value, as
+    returned by `retrieve_secret(secret_name)`.
+    """
+    logger = logging.getLogger("emr_launcher")
+
+    def replace_connection_password(item):
+        try:
+            secret_name = item["Properties"][CONNECTION_PASSWORD]
+            secret_value = retrieve_secret(secret_name)
+        except Exception as e:
+            if not context.lenient_secrets:
+                raise
+            logger.info(e)
+            context.secret_digests[None] = None
+            return item
+        context.secret_digests[secret_name] = _digest(secret_value)
+        return {
+            **item,
+            "Properties": {**item["Properties"], CONNECTION_PASSWORD: secret_value},
+        }
+
+    try:
+        cluster_config.find_replace_all(
+            "Configurations",
+            "Classification",
+            {
+                classification: replace_connection_password
+                for classification in HIVE_SITE_CLASSIFICATIONS
+            },
+        )
+    except Exception as e:
+        if not context.lenient_secrets:
+            raise
+        logger.info(e)
+        context.secret_digests[None] = None
+    return cluster_config
+
+
+@PIPELINE.stage("overrides", applies=lambda context: context.overrides is not None)
+def overrides_stage(cluster_config: ClusterConfig, context: LaunchContext):
+    cluster_config.override(context.overrides)
+    return cluster_config
+
+
+@PIPELINE.stage("extend", applies=lambda context: context.extend is not None)
+def extend_stage(cluster_config: ClusterConfig, context: LaunchContext):
+    for [path, value] in context.extend.items():
+        items = value if isinstance(value, list) else [value]
+        cluster_config.extend_nested_list(path, items)
+    return cluster_config
+
+
+@PIPELINE.stage(
+    "step_args",
+    applies=lambda context: context.additional_step_args is not None
+    or bool(context.event_step_args),
+)
+def step_args_stage(cluster_config: ClusterConfig, context: LaunchContext):
+    """
+    In a single pass over `Steps`, adds `additional_step_args` to the first step with each
+    name, and appends `event_step_args` to the args of every step with a HadoopJarStep.
+    """
+    named_args = dict(context.additional_step_args or {})
+    for position, step in enumerate(cluster_config["Steps"]):
+        args = named_args.pop(step.get("Name"), None)
+        if args is not None:
+            hadoop_jar_step = cluster_config.get_writable_node(
+                "Steps", position, "HadoopJarStep"
+            )
+            if isinstance(hadoop_jar_step["Args"], list):
+                cluster_config.get_writable_node(
+                    "Steps", position, "HadoopJarStep", "Args"
+                ).extend(args)
+            else:
+                hadoop_jar_step["Args"] = args
+        if context.event_step_args and "HadoopJarStep" in step:
+            cluster_config.get_writable_node(
+                "Steps", position, "HadoopJarStep", "Args"
+            ).extend(context.event_step_args)
+    return cluster_config
+
+
+@PIPELINE.stage("tagging", applies=lambda context: bool(context.tags))
+def tags_stage(cluster_config: ClusterConfig, context: LaunchContext):
+    cluster_config.merge_tags(context.tags)
+    return cluster_config
+
+
+@PIPELINE.stage("validate", applies=lambda context: context.validate)
+def validate_stage(cluster_config: ClusterConfig, context: LaunchContext):
+    """
+    Checks the config against the RunJobFlow request model before anything is created for
+    it, raising a ParamValidationError listing every problem.
+    """
+    validate_run_job_flow_request(cluster_config.to_dict())
+    return cluster_config
+
+
+@PIPELINE.stage(
+    "security_configuration", applies=lambda context: context.copy_secconfig
+)
+def security_configuration_stage(cluster_config: ClusterConfig, context: LaunchContext):
+    secconfig_orig = cluster_config.get("SecurityConfiguration", "")
+    if secconfig_orig != "":
+        content = context.security_configuration_contents.get(secconfig_orig)
+        if content is None:
+            secconfig = dup_security_configuration(secconfig_orig, dry_run=context.plan)
+        else:
+            secconfig = dup_security_configuration(
+                secconfig_orig, dry_run=context.plan, content=content
+            )
+        cluster_config["SecurityConfiguration"] = secconfig
+    return cluster_config
+
+
+def validation_enabled() -> bool:
+    """Request validation is on unless EMR_LAUNCHER_VALIDATE_REQUEST is `false`."""
+    return os.getenv("EMR_LAUNCHER_VALIDATE_REQUEST", "true").lower() != "false"
+
 
 def build_config(
     s3_overrides: dict = None,
     override: dict = None,
     extend: dict = None,
     additional_step_args: dict = None,
+    timer=NULL_TIMER,
 ) -> ClusterConfig:
-    cluster_config = read_config("cluster", s3_overrides=s3_overrides)
-    cluster_config.update(read_config("configurations", s3_overrides, False))
-
-    def replace_connection_password(item):
-        secret_name = item["Properties"]["javax.jdo.option.ConnectionPassword"]
-        secret_value = sm_retrieve_secrets(secret_name)
-        item["Properties"]["javax.jdo.option.ConnectionPassword"] = secret_value
-        return item
-
-    cluster_config.find_replace(
-        "Configurations",
-        "Classification",
-        "spark-hive-site",
-        replace_connection_password,
-    )
-    cluster_config.find_replace(
-        "Configurations", "Classification", "hive-site", replace_connection_password
+    return PIPELINE.run(
+        LaunchContext(
+            s3_overrides=s3_overrides,
+            overrides=override,
+            extend=extend,
+            additional_step_args=additional_step_args,
+        ),
+        timer=timer,
     )
 
-    cluster_config.update(read_config("instances", s3_overrides=s3_overrides))
-    cluster_config.update(read_config("steps", s3_overrides, False))
 
-    if override is not None:
-        cluster_config.override(override)
+def async_enabled() -> bool:
+    """Direct launches use `build_config_async` when EMR_LAUNCHER_ASYNC is `true`."""
+    return os.getenv("EMR_LAUNCHER_ASYNC", "false").lower() == "true"
+
+
+def _hive_secret_names(configurations: ClusterConfig) -> set:
+    items = (configurations and configurations["Configurations"]) or []
+    return {
+        item["Properties"][CONNECTION_PASSWORD]
+        for item in items
+        if item.get("Classification") in HIVE_SITE_CLASSIFICATIONS
+        and CONNECTION_PASSWORD in (item.get("Properties") or {})
+    }
+
 
-    if extend is not None:
-        for [path, value] in extend.items():
-            items = value if isinstance(value, list) else [value]
-            cluster_config.extend_nested_list(path, items)
+async def build_config_async(context: LaunchContext, timer=NULL_TIMER) -> ClusterConfig:
+    """
+    Builds the same config as `PIPELINE.run(context)`, but runs the reads that do not
+    depend on each other at the same time, each on a worker thread: every config file is
+    read concurrently, the metastore secrets are fetched as soon as `configurations.yaml` is
+    parsed and the security configuration named in `cluster.yaml` is described as soon as
+    that is. Nothing is created before the config is validated: the copy of the security
+    configuration is made by the pipeline's own stage, using the content described early if
+    the final config still names the same one.
+    """
+    import asyncio
 
-    if additional_step_args is not None:
-        for [step_name, args] in additional_step_args.items():
-            step = next(
-                (s for s in cluster_config["Steps"] if s["Name"] == step_name), None
+    loop = asyncio.get_running_loop()
+    logger = logging.getLogger("emr_launcher")
+
+    def offload(func, *args, **kwargs):
+        return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    if bundle_enabled() and not os.getenv("EMR_LAUNCHER_CONFIG_DIR"):
+        all_configs = asyncio.ensure_future(
+            offload(read_configs, s3_overrides=context.s3_overrides)
+        )
+
+        async def read(config_type):
+            return (await all_configs)[config_type]
+
+    else:
+
+        async def read(config_type):
+            return await offload(
+                read_config,
+                config_type,
+                context.s3_overrides,
+                config_type not in OPTIONAL_CONFIG_TYPES,
             )
-            if step is None:
-                continue
-            step_args = step["HadoopJarStep"]["Args"]
-            if isinstance(step_args, list):
-                step_args.extend(args)
-            else:
-                step["HadoopJarStep"]["Args"] = args
 
-    return cluster_config
+    configs = {
+        config_type: asyncio.ensure_future(read(config_type))
+        for config_type in CONFIG_TYPES
+    }
 
+    async def prefetch_secrets():
+        secret_names = sorted(_hive_secret_names(await configs["configurations"]))
+        values = await asyncio.gather(
+            *(offload(sm_retrieve_secrets, name) for name in secret_names),
+            return_exceptions=True,
+        )
+        # Failed lookups are left to the secrets stage, which handles them as usual.
+        return {
+            name: value
+            for name, value in zip(secret_names, values)
+            if not isinstance(value, Exception)
+        }
+
+    async def describe_security_configuration():
+        name = (await configs["cluster"]).get("SecurityConfiguration")
+        if not name:
+            return {}
+        try:
+            return {name: await offload(emr_describe_security_configuration, name)}
+        except Exception as e:
+            # Left to the security configuration stage, which describes it again.
+            logger.info(e)
+            return {}
+
+    secrets = asyncio.ensure_future(prefetch_secrets())
+    pending = [secrets, *configs.values()]
+    if context.copy_secconfig:
+        security_configurations = asyncio.ensure_future(
+            describe_security_configuration()
+        )
+        pending.append(security_configurations)
+
+    try:
+        with timer.phase("config_load"):
+            loaded = {
+                config_type: await future for config_type, future in configs.items()
+            }
+        cluster_config = _merge_configs(loaded)
+
+        with timer.phase("secrets"):
+            prefetched = await secrets
+            cluster_config = _resolve_secrets(
+                cluster_config,
+                context,
+                lambda name: (
+                    prefetched[name]
+                    if name in prefetched
+                    else sm_retrieve_secrets(name)
+                ),
+            )
 
+        if context.copy_secconfig:
+            context.security_configuration_contents.update(
+                await security_configurations
+            )
+        return PIPELINE.run(context, cluster_config, timer)
+    finally:
+        for future in pending:
+            future.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+@flushes_log
 def handler(event=None, context=None) -> dict:
     payload = get_payload(event)
 
     logger = configure_log()
-    logger.info(payload)
+    logger.info("Received payload %s", LogPayload(payload))
 
     if PAYLOAD_CORRELATION_ID in payload and PAYLOAD_S3_PREFIX in payload:
         raise ValueError(
@@ -108,42 +390,318 @@ def handler(event=None, context=None) -> dict:
         PAYLOAD_EVENT_NOTIFICATION_RECORDS in payload
         and PAYLOAD_BODY in payload[PAYLOAD_EVENT_NOTIFICATION_RECORDS][0]
     ):
-        message = payload[PAYLOAD_EVENT_NOTIFICATION_RECORDS][0]
-        loaded_payload_body = json.loads(message[PAYLOAD_BODY])
-        logger.info(f'Processing payload from SQS", "payload": "{loaded_payload_body}')
-        if (
-            PAYLOAD_EVENT_NOTIFICATION_RECORDS in loaded_payload_body
-            and PAYLOAD_S3 in loaded_payload_body[PAYLOAD_EVENT_NOTIFICATION_RECORDS][0]
-        ):
-            logger.info(f'Using S3 event notification handler", "payload": "{payload}')
-            correlation_id = (
-                message["messageId"] if "messageId" in message else str(uuid.uuid4())
-            )
-            logger.info(f'Correlation id set", "correlation_id": "{correlation_id}')
-            return s3_event_notification_handler(
-                correlation_id,
-                loaded_payload_body[PAYLOAD_EVENT_NOTIFICATION_RECORDS][0],
-            )
+        return sqs_batch_handler(payload[PAYLOAD_EVENT_NOTIFICATION_RECORDS])
 
     try:
-        payload = Payload(**payload)
+        launch_payload = Payload(**payload)
     except:
         raise TypeError("Invalid request payload")
 
-    cluster_config = build_config(
-        payload.s3_overrides,
-        payload.overrides,
-        payload.extend,
-        payload.additional_step_args,
+    if launch_payload.fan_out is not None:
+        return launch_fan_out(launch_payload, payload)
+
+    if launch_payload.plan:
+        return launch_from_payload(launch_payload)
+
+    return idempotent_launch(
+        payload_key(payload), lambda: launch_from_payload(launch_payload)
+    )
+
+
+def launch_from_payload(payload: Payload) -> dict:
+    """Builds the cluster config for a direct invocation and launches it, or plans it."""
+    if payload.plan:
+        timer = PhaseTimer()
+    else:
+        timer = metrics_timer()
+
+    try:
+        context = LaunchContext(
+            s3_overrides=payload.s3_overrides,
+            overrides=payload.overrides,
+            extend=payload.extend,
+            additional_step_args=payload.additional_step_args,
+            copy_secconfig=payload.copy_secconfig,
+            plan=payload.plan,
+            validate=validation_enabled(),
+        )
+        if async_enabled():
+            import asyncio
+
+            cluster_config = asyncio.run(build_config_async(context, timer))
+        else:
+            cluster_config = PIPELINE.run(context, timer=timer)
+
+        if payload.plan:
+            return plan_response(cluster_config, timer)
+
+        return launch_cluster(cluster_config, timer)
+    finally:
+        if not payload.plan:
+            emit_phase_metrics(
+                timer, {"ConfigSource": get_config_source(), "EventType": "direct"}
+            )
+
+
+def fan_out_context(payload: Payload, parameters: FanOutParameters) -> LaunchContext:
+    """
+    Returns the context of one variant of a fan-out launch. Its correlation id, bucket,
+    prefix and export date are added to the args of every step like those of an S3 event,
+    and the correlation id and export date are also added as tags.
+    """
+    event_step_args = []
+    for name in FAN_OUT_STEP_ARGS:
+        value = getattr(parameters, name)
+        if value is not None:
+            event_step_args.extend([f"--{name}", value])
+
+    tags = {}
+    if parameters.correlation_id is not None:
+        tags["Correlation_Id"] = parameters.correlation_id
+    if parameters.export_date is not None:
+        tags["export_date"] = parameters.export_date
+
+    return LaunchContext(
+        overrides=parameters.overrides,
+        extend=parameters.extend,
+        additional_step_args=parameters.additional_step_args,
+        event_step_args=event_step_args,
+        tags=tags,
+        copy_secconfig=payload.copy_secconfig,
+        plan=payload.plan,
+        validate=validation_enabled(),
+    )
+
+
+def launch_fan_out(payload: Payload, raw_payload: dict) -> dict:
+    """
+    Launches one cluster for each parameter set in `fan_out`. The config files are read,
+    the secrets resolved and the payload's own overrides, extend and step args applied only
+    once; each set is then applied to a copy of that config and launched on a bounded thread
+    pool, up to EMR_LAUNCHER_FAN_OUT_WORKERS at a time. A set that fails does not stop the
+    others: the response lists the `JobFlowIds` launched and, under `Launches`, the result
+    or error of each set in order. Each set is idempotent on its own, so a retry of the
+    same payload only launches the sets that failed. The shared build and each set are
+    timed separately, and their metrics emitted as `fan_out` and `fan_out_variant` events.
+    """
+    logger = logging.getLogger("emr_launcher")
+
+    if not isinstance(payload.fan_out, list):
+        raise TypeError("fan_out must be a list of parameter sets")
+
+    def new_timer():
+        return PhaseTimer() if payload.plan else metrics_timer()
+
+    timer = new_timer()
+    variant_timers = [new_timer() for _ in payload.fan_out]
+    try:
+        shared_config = PIPELINE.run(
+            LaunchContext(
+                s3_overrides=payload.s3_overrides,
+                overrides=payload.overrides,
+                extend=payload.extend,
+                additional_step_args=payload.additional_step_args,
+            ),
+            timer=timer,
+        )
+
+        def launch_variant(
+            parameters: dict, cluster_config: ClusterConfig, variant_timer
+        ) -> dict:
+            context = fan_out_context(payload, FanOutParameters(**parameters))
+            cluster_config = PIPELINE.run(context, cluster_config, variant_timer)
+            if payload.plan:
+                return {
+                    "RunJobFlow": redact(cluster_config.to_dict()),
+                    "timings_ms": rounded_timings(variant_timer),
+                }
+            return idempotent_launch(
+                payload_key({**raw_payload, PAYLOAD_FAN_OUT: [parameters]}),
+                lambda: launch_cluster(cluster_config, variant_timer),
+            )
+
+        max_workers = int(
+            os.getenv("EMR_LAUNCHER_FAN_OUT_WORKERS", DEFAULT_FAN_OUT_WORKERS)
+        )
+        launches = []
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(payload.fan_out)))
+        ) as executor:
+            futures = [
+                executor.submit(
+                    launch_variant, parameters, shared_config.derive(), variant_timer
+                )
+                for parameters, variant_timer in zip(payload.fan_out, variant_timers)
+            ]
+            for index, future in enumerate(futures):
+                try:
+                    launches.append(future.result())
+                except Exception as e:
+                    logger.error(
+                        "Failed to launch fan-out variant",
+                        extra={"index": index, "error": str(e)},
+                    )
+                    launches.append({"Error": str(e), "ErrorType": type(e).__name__})
+
+        response = {
+            "JobFlowIds": [
+                launch["JobFlowId"] for launch in launches if "JobFlowId" in launch
+            ],
+            "Launches": launches,
+        }
+        if payload.plan:
+            response["plan"] = True
+            response["timings_ms"] = rounded_timings(timer)
+        return response
+    finally:
+        if not payload.plan:
+            config_source = get_config_source()
+            emit_phase_metrics(
+                timer, {"ConfigSource": config_source, "EventType": "fan_out"}
+            )
+            for variant_timer in variant_timers:
+                emit_phase_metrics(
+                    variant_timer,
+                    {"ConfigSource": config_source, "EventType": "fan_out_variant"},
+                )
+
+
+def launch_cluster(cluster_config: ClusterConfig, timer=NULL_TIMER) -> dict:
+    """
+    Launches a cluster with `cluster_config`. When EMR_LAUNCHER_REUSE_CLUSTERS is enabled its
+    steps are submitted to a matching WAITING cluster instead, if there is one, and a
+    launched cluster is tagged with the fingerprint of its config so it can be reused later.
+    """
+    if reuse_enabled():
+        with timer.phase("reuse"):
+            cluster = find_reusable_cluster(cluster_config)
+            if cluster is not None:
+                return reuse_cluster(cluster, cluster_config)
+        cluster_config.merge_tags({FINGERPRINT_TAG: launch_fingerprint(cluster_config)})
+
+    with timer.phase("run_job_flow"):
+        return emr_launch_cluster(cluster_config)
+
+
+def reuse_cluster(cluster: dict, cluster_config: ClusterConfig) -> dict:
+    """
+    Submits the steps of `cluster_config` to `cluster`, bumps its reuse count and updates
+    its ignored tags, e.g. `Correlation_Id`, so the cluster can be traced to this launch.
+    """
+    logger = logging.getLogger("emr_launcher")
+
+    job_flow_id = cluster["Id"]
+    count = reuse_count(cluster) + 1
+    try:
+        response = emr_add_job_flow_steps(
+            job_flow_id, cluster_config.to_dict()["Steps"]
+        )
+    except Exception:
+        release_cluster(job_flow_id)
+        raise
+
+    ignore_tags = ignored_tags()
+    tags = {
+        tag["Key"]: tag["Value"]
+        for tag in cluster_config["Tags"] or []
+        if tag["Key"] in ignore_tags
+    }
+    emr_cluster_add_tags(job_flow_id, {**tags, REUSE_COUNT_TAG: str(count)})
+    invalidate_waiting_clusters(cluster_config["Name"])
+
+    logger.info(
+        "Reused cluster", extra={"job_flow_id": job_flow_id, "reuse_count": count}
+    )
+    return {
+        "JobFlowId": job_flow_id,
+        "ClusterArn": cluster.get("ClusterArn"),
+        "StepIds": response["StepIds"],
+        "Reused": True,
+    }
+
+
+def plan_response(cluster_config: ClusterConfig, timer: PhaseTimer) -> dict:
+    """
+    Returns what a launch would send to EMR instead of launching: the `run_job_flow` kwargs,
+    with secret values redacted, and the time spent in each phase of building them.
+    """
+    return {
+        "plan": True,
+        "RunJobFlow": redact(cluster_config.to_dict()),
+        "timings_ms": rounded_timings(timer),
+    }
+
+
+def rounded_timings(timer: PhaseTimer) -> dict:
+    return {phase: round(elapsed_ms, 3) for phase, elapsed_ms in timer.timings.items()}
+
+
+def sqs_message_handler(message) -> dict:
+    """Launches an EMR cluster for a single SQS message holding an S3 event notification."""
+    logger = logging.getLogger("emr_launcher")
+
+    loaded_payload_body = json.loads(message[PAYLOAD_BODY])
+    logger.info("Processing payload from SQS %s", LogPayload(loaded_payload_body))
+    if not (
+        PAYLOAD_EVENT_NOTIFICATION_RECORDS in loaded_payload_body
+        and PAYLOAD_S3 in loaded_payload_body[PAYLOAD_EVENT_NOTIFICATION_RECORDS][0]
+    ):
+        raise TypeError("SQS message is not an S3 event notification")
+
+    logger.info("Using S3 event notification handler %s", LogPayload(message))
+    correlation_id = (
+        message["messageId"] if "messageId" in message else str(uuid.uuid4())
+    )
+    logger.info(f'Correlation id set", "correlation_id": "{correlation_id}')
+    return s3_event_notification_handler(
+        correlation_id,
+        loaded_payload_body[PAYLOAD_EVENT_NOTIFICATION_RECORDS][0],
+    )
+
+
+def report_batch_item_failures() -> bool:
+    """Whether EMR_LAUNCHER_SQS_REPORT_BATCH_ITEM_FAILURES is `true`."""
+    return (
+        os.getenv("EMR_LAUNCHER_SQS_REPORT_BATCH_ITEM_FAILURES", "false").lower()
+        == "true"
     )
 
-    if payload.copy_secconfig:
-        secconfig_orig = cluster_config.get("SecurityConfiguration", "")
-        if secconfig_orig != "":
-            secconfig = dup_security_configuration(secconfig_orig)
-            cluster_config["SecurityConfiguration"] = secconfig
 
-    return emr_launch_cluster(cluster_config)
+def sqs_batch_handler(messages: list) -> dict:
+    """
+    Handles every message in an SQS batch on a bounded thread pool. If batch item failures
+    are reported, returns the IDs of the messages that failed as `batchItemFailures`, so
+    only those are redelivered. Otherwise the first failure is raised once every message
+    has been handled, so the whole batch is redelivered.
+    """
+    logger = logging.getLogger("emr_launcher")
+    max_workers = int(
+        os.getenv("EMR_LAUNCHER_SQS_BATCH_WORKERS", DEFAULT_SQS_BATCH_WORKERS)
+    )
+
+    batch_item_failures = []
+    first_error = None
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(messages)))
+    ) as executor:
+        futures = [
+            (message, executor.submit(sqs_message_handler, message))
+            for message in messages
+        ]
+        for message, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(
+                    "Failed to process SQS message",
+                    extra={"message_id": message.get("messageId"), "error": str(e)},
+                )
+                batch_item_failures.append({"itemIdentifier": message.get("messageId")})
+                first_error = first_error or e
+
+    if first_error is not None and not report_batch_item_failures():
+        raise first_error
+    return {"batchItemFailures": batch_item_failures}
 
 
 def get_value(key, event):
@@ -161,7 +719,7 @@ def get_value(key, event):
 def s3_event_notification_handler(correlation_id, record=None) -> dict:
     """Launches an EMR cluster with the provided configuration."""
     logger = configure_log()
-    logger.info(record)
+    logger.info("S3 event notification record %s", LogPayload(record))
 
     export_date = get_event_time_as_date_string(get_value(PAYLOAD_EVENT_TIME, record))
     s3_object = get_value(PAYLOAD_S3, record)
@@ -170,113 +728,86 @@ def s3_event_notification_handler(correlation_id, record=None) -> dict:
     s3_prefix = get_value(PAYLOAD_KEY, s3_object_object)
     s3_bucket_name = get_value(PAYLOAD_NAME, s3_bucket_object)
 
-    cluster_config = read_config("cluster")
-    configurations_config_yml_name = "configurations"
-
-    cluster_config.update(
-        read_config(
-            config_type=configurations_config_yml_name,
-            s3_overrides=None,
-            required=False,
-        )
+    return idempotent_launch(
+        correlation_id_key(correlation_id),
+        lambda: launch_from_s3_event(
+            correlation_id, export_date, s3_bucket_name, s3_prefix
+        ),
     )
 
-    try:
-        if (
-            next(
-                (
-                    sub
-                    for sub in cluster_config["Configurations"]
-                    if sub["Classification"] == "spark-hive-site"
-                ),
-                None,
-            )
-            is not None
-        ):
-            secret_name = next(
-                (
-                    sub
-                    for sub in cluster_config["Configurations"]
-                    if sub["Classification"] == "spark-hive-site"
-                ),
-                None,
-            )["Properties"]["javax.jdo.option.ConnectionPassword"]
-            secret_value = sm_retrieve_secrets(secret_name)
-            next(
-                (
-                    sub
-                    for sub in cluster_config["Configurations"]
-                    if sub["Classification"] == "spark-hive-site"
-                ),
-                None,
-            )["Properties"]["javax.jdo.option.ConnectionPassword"] = secret_value
-    except Exception as e:
-        logger.info(e)
 
-    try:
-        if (
-            next(
-                (
-                    sub
-                    for sub in cluster_config["Configurations"]
-                    if sub["Classification"] == "hive-site"
-                ),
-                None,
+def s3_event_base_config(context: LaunchContext, timer=NULL_TIMER) -> ClusterConfig:
+    """
+    Returns the result of the base stages of the pipeline, i.e. all config types merged with
+    secrets resolved. It is memoized per config location and reused for as long as the
+    fingerprint of the config files and the values of the secrets stay the same. The result
+    is a `derive`d copy, which the caller may change freely.
+    """
+    with timer.phase("config_load"):
+        location, fingerprint = config_fingerprint(s3_overrides=context.s3_overrides)
+        cached = BASE_CONFIG_CACHE.get(location)
+
+    if cached is not None and cached[0] == fingerprint:
+        with timer.phase("secrets"):
+            secrets_unchanged = all(
+                _digest(sm_retrieve_secrets(secret_name)) == digest
+                for secret_name, digest in cached[1].items()
             )
-            is not None
-        ):
-            secret_name = next(
-                (
-                    sub
-                    for sub in cluster_config["Configurations"]
-                    if sub["Classification"] == "hive-site"
-                ),
-                None,
-            )["Properties"]["javax.jdo.option.ConnectionPassword"]
-            secret_value = sm_retrieve_secrets(secret_name)
-            next(
-                (
-                    sub
-                    for sub in cluster_config["Configurations"]
-                    if sub["Classification"] == "hive-site"
-                ),
-                None,
-            )["Properties"]["javax.jdo.option.ConnectionPassword"] = secret_value
-    except Exception as e:
-        logger.info(e)
+        if secrets_unchanged:
+            BASE_CONFIG_CACHE.count("hits")
+            return cached[2].derive()
+
+    def rebuild():
+        base_config = PIPELINE.run_base(context, timer)
+        BASE_CONFIG_CACHE.count("misses")
+        if None not in context.secret_digests.values():
+            BASE_CONFIG_CACHE.set(
+                location, (fingerprint, dict(context.secret_digests), base_config)
+            )
+        return base_config
 
-    cluster_config.update(read_config("instances"))
-    cluster_config.update(
-        read_config(config_type="steps", s3_overrides=None, required=False)
-    )
+    # Events handled at the same time, e.g. from one SQS batch, share a single rebuild.
+    return _base_config_in_flight.do((location, fingerprint), rebuild).derive()
 
-    HADOOP_JAR_STEP = "HadoopJarStep"
-    ARGS = "Args"
-    STEPS = "Steps"
-    for sub in cluster_config[STEPS]:
-        if HADOOP_JAR_STEP in sub:
-            script_args = sub[HADOOP_JAR_STEP][ARGS]
-            script_args.append("--correlation_id")
-            script_args.append(correlation_id)
-            script_args.append("--s3_bucket_name")
-            script_args.append(s3_bucket_name)
-            script_args.append("--s3_prefix")
-            script_args.append(s3_prefix)
-            script_args.append("--export_date")
-            script_args.append(export_date)
-            sub[HADOOP_JAR_STEP][ARGS] = script_args
-
-    resp = emr_launch_cluster(cluster_config)
-    job_flow_id = resp["JobFlowId"]
-    logger.debug(resp)
-
-    additional_tags = {
-        "Correlation_Id": correlation_id,
-        "export_date": export_date,
-    }
 
-    emr_cluster_add_tags(job_flow_id, additional_tags)
-    return resp
+def _digest(value):
+    if value is None:
+        return None
+    return hashlib.sha256(str(value).encode("utf-8")).hexdigest()
+
+
+def launch_from_s3_event(correlation_id, export_date, s3_bucket_name, s3_prefix):
+    """Stamps the event's values into a copy of the base config and launches it."""
+    logger = logging.getLogger("emr_launcher")
+
+    timer = metrics_timer()
+    try:
+        context = LaunchContext(
+            event_step_args=[
+                "--correlation_id",
+                correlation_id,
+                "--s3_bucket_name",
+                s3_bucket_name,
+                "--s3_prefix",
+                s3_prefix,
+                "--export_date",
+                export_date,
+            ],
+            tags={"Correlation_Id": correlation_id, "export_date": export_date},
+            validate=validation_enabled(),
+            lenient_secrets=True,
+        )
+        cluster_config = PIPELINE.run(
+            context, s3_event_base_config(context, timer), timer=timer
+        )
+
+        resp = launch_cluster(cluster_config, timer)
+        logger.debug(resp)
+        return resp
+    finally:
+        emit_phase_metrics(
+            timer, {"ConfigSource": get_config_source(), "EventType": "s3_event"}
+        )
 
 
 def get_event_time_as_date_string(event_time):
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from typing import Callable
+
+from emr_launcher.aws import _get_client
+
+logger = logging.getLogger("emr_launcher")
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+
+DEFAULT_EXPIRY = 3600
+DEFAULT_IN_PROGRESS_EXPIRY = 900
+DEFAULT_WAIT = 30
+POLL_INTERVAL = 0.5
+DEFAULT_FILE_DIR = "/tmp/emr-launcher-idempotency"
+
+# Only these keys of the run_job_flow response are recorded and returned for repeats.
+RESPONSE_KEYS = ("JobFlowId", "ClusterArn")
+
+
+class LaunchInProgressError(Exception):
+    pass
+
+
+class IdempotencyStore(ABC):
+    """
+    Records launches by idempotency key. A record is a dict with `status`, `expires_at` (epoch
+    seconds) and, once completed, the `response` of the launch.
+    """
+
+    @abstractmethod
+    def claim(self, key: str, expires_at: float):
+        """
+        Atomically records `key` as in progress and returns None, unless an unexpired record
+        already exists, in which case that record is returned and nothing is written.
+        """
+
+    @abstractmethod
+    def complete(self, key: str, response: dict, expires_at: float):
+        """Marks `key` as completed with the `response` of the launch."""
+
+    @abstractmethod
+    def release(self, key: str):
+        """Removes the record for `key`, so the launch can be attempted again."""
+
+
+class MemoryStore(IdempotencyStore):
+    """Keeps records in this process only, i.e. across warm invocations of one Lambda."""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, expires_at: float):
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None and record["expires_at"] > time.time():
+                return dict(record)
+            self._records[key] = {"status": IN_PROGRESS, "expires_at": expires_at}
+
+    def complete(self, key: str, response: dict, expires_at: float):
+        with self._lock:
+            self._records[key] = {
+                "status": COMPLETED,
+                "expires_at": expires_at,
+                "response": response,
+            }
+
+    def release(self, key: str):
+        with self._lock:
+            self._records.pop(key, None)
+
+
+class FileStore(IdempotencyStore):
+    """Keeps one JSON file per key in `directory`, shared by processes on the same host."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(
+            self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def _write(self, path: str, record: dict):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(temp_path, path)
+
+    def claim(self, key: str, expires_at: float):
+        path = self._path(key)
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(path, "r") as f:
+                        record = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    # Released, or not fully written yet by another claimant.
+                    time.sleep(0.01)
+                    continue
+                if record["expires_at"] > time.time():
+                    return record
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+
+            with os.fdopen(fd, "w") as f:
+                json.dump({"status": IN_PROGRESS, "expires_at": expires_at}, f)
+            return None
+
+    def complete(self, key: str, response: dict, expires_at: float):
+        self._write(
+            self._path(key),
+            {"status": COMPLETED, "expires_at": expires_at, "response": response},
+        )
+
+    def release(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class DynamoDBStore(IdempotencyStore):
+    """
+    Keeps records in a DynamoDB table with the string partition key `id`, shared by every
+    Lambda. Enable TTL on the `expires_at` attribute to have expired records removed.
+    """
+
+    def __init__(self, table_name: str, dynamodb_client=None):
+        self.table_name = table_name
+        self._client = dynamodb_client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = _get_client(service_name="dynamodb")
+        return self._client
+
+    def claim(self, key: str, expires_at: float):
+        now = time.time()
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "id": {"S": key},
+                    "status": {"S": IN_PROGRESS},
+                    "expires_at": {"N": str(int(expires_at))},
+                },
+                ConditionExpression="attribute_not_exists(id) OR expires_at < :now",
+                ExpressionAttributeValues={":now": {"N": str(int(now))}},
+            )
+            return None
+        except self.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+        item = self.client.get_item(
+            TableName=self.table_name, Key={"id": {"S": key}}, ConsistentRead=True
+        ).get("Item")
+        if item is None:
+            # Released in the meantime.
+            return self.claim(key, expires_at)
+        record = {
+            "status": item["status"]["S"],
+            "expires_at": int(item["expires_at"]["N"]),
+        }
+        if "response" in item:
+            record["response"] = json.loads(item["response"]["S"])
+        return record
+
+    def complete(self, key: str, response: dict, expires_at: float):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "id": {"S": key},
+                "status": {"S": COMPLETED},
+                "expires_at": {"N": str(int(expires_at))},
+                "response": {"S": json.dumps(response)},
+            },
+        )
+
+    def release(self, key: str):
+        self.client.delete_item(TableName=self.table_name, Key={"id": {"S": key}})
+
+
+_memory_store = MemoryStore()
+
+
+def get_store():
+    """
+    Returns the store selected by EMR_LAUNCHER_IDEMPOTENCY_STORE (`memory`, `file` or
+    `dynamodb`), or None if idempotency is disabled, which is the default.
+    """
+    store_type = os.getenv("EMR_LAUNCHER_IDEMPOTENCY_STORE", "").lower()
+    if not store_type:
+        return None
+    if store_type == "memory":
+        return _memory_store
+    if store_type == "file":
+        return FileStore(os.getenv("EMR_LAUNCHER_IDEMPOTENCY_DIR", DEFAULT_FILE_DIR))
+    if store_type == "dynamodb":
+        table_name = os.getenv("EMR_LAUNCHER_IDEMPOTENCY_TABLE")
+        if not table_name:
+            raise ValueError(
+                "EMR_LAUNCHER_IDEMPOTENCY_TABLE must be set for the dynamodb store"
+            )
+        return DynamoDBStore(table_name)
+    raise ValueError("Invalid idempotency store: %s" % store_type)
+
+
+def payload_key(payload: dict) -> str:
+    """Returns an idempotency key for a direct invocation, derived from its payload."""
+    content = json.dumps(payload, sort_keys=True, default=str)
+    return "payload:" + hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def correlation_id_key(correlation_id: str) -> str:
+    return "correlation_id:" + correlation_id
+
+
+def idempotent_launch(key: str, launch: Callable[[], dict], store=None) -> dict:
+    """
+    Calls `launch` unless a launch with the same `key` completed within the last
+    EMR_LAUNCHER_IDEMPOTENCY_EXPIRY seconds, in which case its JobFlowId is returned instead.
+    If the same launch is in progress elsewhere, waits up to EMR_LAUNCHER_IDEMPOTENCY_WAIT
+    seconds for it to complete and raises LaunchInProgressError if it does not. A failed
+    launch is released, so a retry launches again.
+    """
+    if store is None:
+        store = get_store()
+    if store is None:
+        return launch()
+
+    expiry = float(os.getenv("EMR_LAUNCHER_IDEMPOTENCY_EXPIRY", DEFAULT_EXPIRY))
+    in_progress_expiry = float(
+        os.getenv(
+            "EMR_LAUNCHER_IDEMPOTENCY_IN_PROGRESS_EXPIRY", DEFAULT_IN_PROGRESS_EXPIRY
+        )
+    )
+    deadline = time.monotonic() + float(
+        os.getenv("EMR_LAUNCHER_IDEMPOTENCY_WAIT", DEFAULT_WAIT)
+    )
+
+    while True:
+        record = store.claim(key, time.time() + in_progress_expiry)
+        if record is None:
+            break
+        if record["status"] == COMPLETED:
+            logger.info(
+                "Launch already completed, returning its cluster",
+                extra={"idempotency_key": key, **record["response"]},
+            )
+            return dict(record["response"])
+        if time.monotonic() >= deadline:
+            raise LaunchInProgressError(f"Launch {key} is already in progress")
+        logger.info("Launch in progress, waiting", extra={"idempotency_key": key})
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        response = launch()
+    except BaseException:
+        store.release(key)
+        raise
+
+    store.complete(
+        key,
+        {name: response[name] for name in RESPONSE_KEYS if name in response},
+        time.time() + expiry,
+    )
+    return response
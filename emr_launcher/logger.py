@@ -1,24 +1,166 @@
+import atexit
+import copy
+import functools
+import json
 import os
 import logging
-from pythonjsonlogger import jsonlogger
+import logging.handlers
+import queue
+import re
+import threading
+
+from collections.abc import Mapping
+
+LOG_FORMAT = "%(asctime)s %(name)-12s %(levelname)-8s %(message)s"
+
+DEFAULT_MAX_PAYLOAD_CHARS = 4096
+REDACTED = "***REDACTED***"
+SECRET_KEY_PATTERN = re.compile(r"password|secret|token|credential", re.IGNORECASE)
+
+_queue_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Resolve the message while its arguments are still current, but leave JSON
+        # formatting (including dict messages and tracebacks) to the listener thread.
+        record = copy.copy(record)
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
 
 
 def configure_log():
-    """Configure JSON logger."""
+    """Configure JSON logger.
+
+    The root logger gets a single queue handler, and a background listener formats records
+    as JSON and writes them out. Calling this again only refreshes the log level, so the
+    number of handlers stays the same however many times it is called.
+    """
+    global _queue_handler, _listener
+
     log_level = os.environ.get("EMR_LAUNCHER_LOG_LEVEL", "INFO").upper()
     numeric_level = getattr(logging, log_level, None)
     if not isinstance(numeric_level, int):
         raise ValueError("Invalid log level: %s" % log_level)
-    if len(logging.getLogger().handlers) > 0:
-        logging.getLogger().setLevel(log_level)
-    else:
-        logging.basicConfig(level=log_level)
+
     logger = logging.getLogger()
+    logger.setLevel(log_level)
     logger.propagate = False
-    console_handler = logging.StreamHandler()
-    formatter = jsonlogger.JsonFormatter(
-        "%(asctime)s %(name)-12s %(levelname)-8s %(message)s"
-    )
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+
+    with _configure_lock:
+        if _queue_handler is None:
+            from pythonjsonlogger import jsonlogger
+
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(jsonlogger.JsonFormatter(LOG_FORMAT))
+
+            log_queue = queue.Queue(-1)
+            _queue_handler = _QueueHandler(log_queue)
+            _listener = logging.handlers.QueueListener(log_queue, console_handler)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+        if _queue_handler not in logger.handlers:
+            logger.addHandler(_queue_handler)
+
     return logger
+
+
+def flush_log():
+    """Blocks until every record queued so far has been written."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.queue.join()
+
+
+def flushes_log(func):
+    """Decorator that flushes queued log records when `func` returns or raises, so nothing
+    is left in the queue when Lambda freezes the execution environment."""
+
+    @functools.wraps(func)
+    def new_func(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            flush_log()
+
+    return new_func
+
+
+def redact(node):
+    """Returns a copy of `node` with the values of secret-looking keys replaced by REDACTED."""
+    if isinstance(node, Mapping):
+        return {
+            key: (
+                REDACTED
+                if value is not None and SECRET_KEY_PATTERN.search(str(key))
+                else redact(value)
+            )
+            for key, value in node.items()
+        }
+    if isinstance(node, (list, tuple)):
+        return [redact(item) for item in node]
+    return node
+
+
+def _render_chunks(node):
+    if isinstance(node, Mapping):
+        yield "{"
+        for i, (key, value) in enumerate(node.items()):
+            if i:
+                yield ", "
+            yield json.dumps(str(key))
+            yield ": "
+            if SECRET_KEY_PATTERN.search(str(key)):
+                yield json.dumps(REDACTED)
+            else:
+                yield from _render_chunks(value)
+        yield "}"
+    elif isinstance(node, (list, tuple)):
+        yield "["
+        for i, item in enumerate(node):
+            if i:
+                yield ", "
+            yield from _render_chunks(item)
+        yield "]"
+    else:
+        try:
+            yield json.dumps(node)
+        except TypeError:
+            yield json.dumps(str(node))
+
+
+class LogPayload:
+    """
+    Wraps a payload or config passed as a log argument, e.g.
+    `logger.debug("Config %s", LogPayload(config))`. It is rendered as JSON only when the
+    record is emitted, with values of secret-looking keys redacted, and rendering stops
+    once `max_chars` (default EMR_LAUNCHER_LOG_MAX_PAYLOAD_CHARS) have been produced.
+    """
+
+    __slots__ = ("payload", "max_chars")
+
+    def __init__(self, payload, max_chars: int = None):
+        self.payload = payload
+        self.max_chars = max_chars
+
+    def __str__(self):
+        max_chars = self.max_chars
+        if max_chars is None:
+            max_chars = int(
+                os.getenv(
+                    "EMR_LAUNCHER_LOG_MAX_PAYLOAD_CHARS", DEFAULT_MAX_PAYLOAD_CHARS
+                )
+            )
+
+        rendered = []
+        length = 0
+        for chunk in _render_chunks(self.payload):
+            rendered.append(chunk)
+            length += len(chunk)
+            if 0 < max_chars < length:
+                return "".join(rendered)[:max_chars] + "...[truncated]"
+        return "".join(rendered)
@@ -0,0 +1,49 @@
+import logging
+import os
+import time
+
+from emr_launcher.timing import PhaseTimer, NULL_TIMER
+
+DEFAULT_METRICS_NAMESPACE = "EmrLauncher"
+
+logger = logging.getLogger("emr_launcher")
+
+
+def metrics_enabled() -> bool:
+    return os.getenv("EMR_LAUNCHER_METRICS_ENABLED", "false").lower() == "true"
+
+
+def metrics_timer():
+    """Returns a PhaseTimer when metrics are enabled, otherwise the no-op NULL_TIMER."""
+    return PhaseTimer() if metrics_enabled() else NULL_TIMER
+
+
+def emit_phase_metrics(timer, dimensions: dict):
+    """
+    Logs the phase timings recorded by `timer` as a CloudWatch Embedded Metric Format
+    document, with one millisecond metric per phase and `dimensions` as its dimensions.
+    """
+    if not timer.timings:
+        return
+
+    namespace = os.getenv("EMR_LAUNCHER_METRICS_NAMESPACE", DEFAULT_METRICS_NAMESPACE)
+    logger.info(
+        "Launch phase timings",
+        extra={
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": phase, "Unit": "Milliseconds"}
+                            for phase in timer.timings
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+            **timer.timings,
+        },
+    )
@@ -0,0 +1,93 @@
+from dataclasses import dataclass, field
+from typing import Callable
+
+from emr_launcher.ClusterConfig import ClusterConfig
+from emr_launcher.timing import NULL_TIMER
+
+
+@dataclass
+class LaunchContext:
+    """The inputs of a launch, shared by every stage of the pipeline."""
+
+    s3_overrides: dict = None
+    overrides: dict = None
+    extend: dict = None
+    additional_step_args: dict = None
+    event_step_args: list = None
+    tags: dict = None
+    copy_secconfig: bool = False
+    plan: bool = False
+    validate: bool = False
+    # Log and skip secrets that cannot be resolved instead of failing the launch.
+    lenient_secrets: bool = False
+    # Digest of each secret value resolved by the pipeline, keyed by secret name.
+    secret_digests: dict = field(default_factory=dict)
+    # Content of security configurations that were already described, keyed by name.
+    security_configuration_contents: dict = field(default_factory=dict)
+
+
+@dataclass
+class Stage:
+    name: str
+    transform: Callable
+    applies: Callable
+    base: bool
+
+
+class Pipeline:
+    """
+    An ordered list of named stages that each transform a ClusterConfig, given the launch
+    context. A stage is skipped when its `applies` predicate is false for the context.
+    Stages marked `base` only depend on the config files and secrets, so their result can be
+    built once with `run_base` and shared by several launches. Each stage that runs is timed
+    as a phase of the `timer` passed to `run`, under the stage's name.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def stage(self, name: str, applies: Callable = None, base: bool = False):
+        """
+        Decorator registering `transform(cluster_config, context)` as the next stage. It must
+        return the transformed config, which it may change in place.
+        """
+
+        def register(transform):
+            self.stages.append(
+                Stage(name, transform, applies or (lambda context: True), base)
+            )
+            return transform
+
+        return register
+
+    def _run(self, stages, context, cluster_config, timer):
+        for stage in stages:
+            if stage.applies(context):
+                with timer.phase(stage.name):
+                    cluster_config = stage.transform(cluster_config, context)
+        return cluster_config
+
+    def run_base(self, context: LaunchContext, timer=NULL_TIMER) -> ClusterConfig:
+        """Runs only the base stages, returning the config they build."""
+        return self._run(
+            [stage for stage in self.stages if stage.base], context, None, timer
+        )
+
+    def run(
+        self,
+        context: LaunchContext,
+        base_config: ClusterConfig = None,
+        timer=NULL_TIMER,
+    ) -> ClusterConfig:
+        """
+        Runs every stage and returns the resulting config. If `base_config` is given, the
+        base stages are skipped and the remaining ones transform it in place.
+        """
+        if base_config is None:
+            return self._run(self.stages, context, None, timer)
+        return self._run(
+            [stage for stage in self.stages if not stage.base],
+            context,
+            base_config,
+            timer,
+        )
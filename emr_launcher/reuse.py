@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from emr_launcher.aws import emr_describe_waiting_clusters
+from emr_launcher.ClusterConfig import ClusterConfig
+from emr_launcher.logger import redact
+
+# Tag on a reused cluster counting the launches that were submitted to it as steps.
+REUSE_COUNT_TAG = "emr-launcher:reuse-count"
+
+# Tag on a launched cluster holding the `launch_fingerprint` of the config it was launched
+# from. Clusters without it are never reused.
+FINGERPRINT_TAG = "emr-launcher:config-fingerprint"
+
+# Keys of a config that do not decide what a cluster launched from it can run. The name and
+# tags are compared on their own.
+FINGERPRINT_EXCLUDED_KEYS = ("Name", "Steps", "Tags")
+
+# Seconds a cluster picked for reuse is kept from being picked again by this process, long
+# enough for EMR to report it as no longer WAITING.
+CLAIM_SECONDS = 300
+
+# Tags that differ between launches of the same cluster and are not compared when matching.
+DEFAULT_IGNORE_TAGS = "Correlation_Id,export_date"
+DEFAULT_MAX_REUSES = 10
+
+
+def reuse_enabled() -> bool:
+    return os.getenv("EMR_LAUNCHER_REUSE_CLUSTERS", "false").lower() == "true"
+
+
+def ignored_tags() -> set:
+    return set(
+        os.getenv("EMR_LAUNCHER_REUSE_IGNORE_TAGS", DEFAULT_IGNORE_TAGS).split(",")
+    )
+
+
+def launch_fingerprint(cluster_config: ClusterConfig) -> str:
+    """
+    Returns a hash of everything in `cluster_config` that shapes the cluster launched from
+    it, e.g. its release label, instances, applications, configurations, bootstrap actions
+    and security configuration. Secret values are redacted before hashing.
+    """
+    launch_config = {
+        key: value
+        for key, value in cluster_config.to_dict().items()
+        if key not in FINGERPRINT_EXCLUDED_KEYS
+    }
+    content = json.dumps(redact(launch_config), sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+_claims = {}
+_claims_lock = threading.Lock()
+
+
+def claim_cluster(cluster_id: str) -> bool:
+    """
+    Returns True and claims `cluster_id` for CLAIM_SECONDS, unless another launch in this
+    process already claimed it, so concurrent launches do not submit to the same cluster.
+    """
+    now = time.monotonic()
+    with _claims_lock:
+        if _claims.get(cluster_id, 0) > now:
+            return False
+        for claimed_id in [key for key, until in _claims.items() if until <= now]:
+            del _claims[claimed_id]
+        _claims[cluster_id] = now + CLAIM_SECONDS
+        return True
+
+
+def release_cluster(cluster_id: str):
+    with _claims_lock:
+        _claims.pop(cluster_id, None)
+
+
+def reuse_count(cluster: dict) -> int:
+    for tag in cluster.get("Tags", []):
+        if tag["Key"] == REUSE_COUNT_TAG:
+            return int(tag["Value"])
+    return 0
+
+
+def matches(cluster: dict, cluster_config: ClusterConfig, fingerprint: str) -> bool:
+    """
+    Returns whether `cluster`, as described by `describe_cluster`, can run the steps of
+    `cluster_config`: it has the same name, was launched from a config with the same
+    `fingerprint`, carries every tag of the config apart from those in
+    EMR_LAUNCHER_REUSE_IGNORE_TAGS, and has been reused fewer than EMR_LAUNCHER_REUSE_MAX
+    times.
+    """
+    if cluster.get("Name") != cluster_config["Name"]:
+        return False
+
+    max_reuses = int(os.getenv("EMR_LAUNCHER_REUSE_MAX", DEFAULT_MAX_REUSES))
+    if reuse_count(cluster) >= max_reuses:
+        return False
+
+    cluster_tags = {tag["Key"]: tag["Value"] for tag in cluster.get("Tags", [])}
+    if cluster_tags.get(FINGERPRINT_TAG) != fingerprint:
+        return False
+
+    ignore_tags = ignored_tags()
+    return all(
+        cluster_tags.get(tag["Key"]) == tag["Value"]
+        for tag in cluster_config["Tags"] or []
+        if tag["Key"] not in ignore_tags
+    )
+
+
+def find_reusable_cluster(cluster_config: ClusterConfig, emr_client=None):
+    """
+    Returns the description of a WAITING cluster that the steps of `cluster_config` can be
+    submitted to, preferring the least reused one, or None if there is none. The cluster is
+    claimed with `claim_cluster`; release it if the steps cannot be submitted.
+    """
+    if not cluster_config["Steps"] or not cluster_config["Name"]:
+        return None
+
+    fingerprint = launch_fingerprint(cluster_config)
+    candidates = [
+        cluster
+        for cluster in emr_describe_waiting_clusters(cluster_config["Name"], emr_client)
+        if matches(cluster, cluster_config, fingerprint)
+    ]
+    for cluster in sorted(candidates, key=reuse_count):
+        if claim_cluster(cluster["Id"]):
+            return cluster
+    return None
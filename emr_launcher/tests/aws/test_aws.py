@@ -1,8 +1,28 @@
 import pytest
+import threading
+import time
 
-from emr_launcher.aws import emr_cluster_add_tags
+from datetime import datetime, timedelta, timezone
+
+from emr_launcher.aws import (
+    emr_cluster_add_tags,
+    _get_client,
+    reset_clients,
+    sm_retrieve_secrets,
+    invalidate_secrets,
+    dup_security_configuration,
+    emr_launch_cluster,
+    reset_rate_limiters,
+    _get_rate_limiter,
+    cleanup_security_configurations,
+    security_configuration_duplicate_name,
+    SECURITY_CONFIGS_CACHE,
+)
 
 import boto3
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+from unittest.mock import patch, MagicMock
 
 from moto import mock_emr
 
@@ -37,3 +57,479 @@ class TestConfig:
         for key, value in tags.items():
             tag_to_check = {"Key": key, "Value": value}
             assert tag_to_check in cluster_tags
+
+    def test_emr_cluster_add_tags_single_call(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        tags = {"Correlation_Id": "test_correlation_id", "export_date": "test_data"}
+
+        with Stubber(emr_client) as stubber:
+            stubber.add_response(
+                "add_tags",
+                {},
+                {
+                    "ResourceId": "j-TEST",
+                    "Tags": [
+                        {"Key": "Correlation_Id", "Value": "test_correlation_id"},
+                        {"Key": "export_date", "Value": "test_data"},
+                    ],
+                },
+            )
+            emr_cluster_add_tags("j-TEST", tags, emr_client)
+            stubber.assert_no_pending_responses()
+
+    def test_dup_security_configuration_dry_run(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+
+        with Stubber(emr_client) as stubber:
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": "test_secconfig", "SecurityConfiguration": "{}"},
+                {"Name": "test_secconfig"},
+            )
+            actual = dup_security_configuration(
+                "test_secconfig", emr_client, dry_run=True
+            )
+            stubber.assert_no_pending_responses()
+
+        assert actual.startswith("test_secconfig_")
+
+    def test_get_client_reuses_pooled_client(self):
+        reset_clients()
+        first = _get_client("emr", region_name="eu-west-2")
+        second = _get_client("emr", region_name="eu-west-2")
+
+        assert first is second
+        assert first.meta.config.max_pool_connections == 10
+
+    def test_get_client_pools_per_service_and_region(self):
+        reset_clients()
+        emr_london = _get_client("emr", region_name="eu-west-2")
+        emr_ireland = _get_client("emr", region_name="eu-west-1")
+        s3_london = _get_client("s3", region_name="eu-west-2")
+
+        assert emr_london is not emr_ireland
+        assert emr_london is not s3_london
+        assert s3_london.meta.config.max_pool_connections == 20
+
+    def test_reset_clients_invalidates_pool(self):
+        reset_clients()
+        first = _get_client("emr", region_name="eu-west-2")
+        reset_clients()
+        second = _get_client("emr", region_name="eu-west-2")
+
+        assert first is not second
+
+    def test_sm_retrieve_secrets_cached(self):
+        invalidate_secrets()
+        sm_client = boto3.client("secretsmanager", region_name="eu-west-2")
+
+        with Stubber(sm_client) as stubber:
+            stubber.add_response(
+                "get_secret_value",
+                {"SecretString": "{'password': 'test-password'}"},
+                {"SecretId": "metastore"},
+            )
+            first = sm_retrieve_secrets("metastore", sm_client)
+            second = sm_retrieve_secrets("metastore", sm_client)
+            stubber.assert_no_pending_responses()
+
+        assert first == second == "test-password"
+
+    def test_sm_retrieve_secrets_invalidated(self):
+        invalidate_secrets()
+        sm_client = boto3.client("secretsmanager", region_name="eu-west-2")
+
+        with Stubber(sm_client) as stubber:
+            for password in ["old-password", "new-password"]:
+                stubber.add_response(
+                    "get_secret_value",
+                    {"SecretString": f"{{'password': '{password}'}}"},
+                    {"SecretId": "metastore"},
+                )
+            assert sm_retrieve_secrets("metastore", sm_client) == "old-password"
+            invalidate_secrets("metastore")
+            assert sm_retrieve_secrets("metastore", sm_client) == "new-password"
+
+    def test_sm_retrieve_secrets_single_flight(self):
+        invalidate_secrets()
+
+        class SlowSecretsClient:
+            calls = 0
+
+            def get_secret_value(self, SecretId):
+                SlowSecretsClient.calls += 1
+                time.sleep(0.1)
+                return {"SecretString": "{'password': 'test-password'}"}
+
+        sm_client = SlowSecretsClient()
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    sm_retrieve_secrets("metastore", sm_client)
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert SlowSecretsClient.calls == 1
+        assert results == ["test-password"] * 8
+
+    def test_sm_retrieve_secrets_not_found_not_cached(self):
+        invalidate_secrets()
+        sm_client = boto3.client("secretsmanager", region_name="eu-west-2")
+
+        with Stubber(sm_client) as stubber:
+            stubber.add_client_error(
+                "get_secret_value",
+                service_error_code="ResourceNotFoundException",
+                expected_params={"SecretId": "metastore"},
+            )
+            stubber.add_response(
+                "get_secret_value",
+                {"SecretString": "{'password': 'test-password'}"},
+                {"SecretId": "metastore"},
+            )
+            assert sm_retrieve_secrets("metastore", sm_client) is None
+            assert sm_retrieve_secrets("metastore", sm_client) == "test-password"
+
+
+class FakeClock:
+    """Stands in for the time module, advancing a virtual clock instead of sleeping."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestEmrRateLimiting:
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_EMR_API_RATE", "5")
+        monkeypatch.setenv("EMR_LAUNCHER_EMR_API_BURST", "10")
+        clock = FakeClock()
+        with patch("emr_launcher.aws.time", clock):
+            reset_rate_limiters()
+            yield clock
+        reset_rate_limiters()
+
+    def test_launches_succeed_despite_throttling(self, clock):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        config = {"Name": "TestCluster", "Instances": {}}
+
+        with Stubber(emr_client) as stubber:
+            for i in range(30):
+                if i % 2 == 0:
+                    stubber.add_client_error(
+                        "run_job_flow",
+                        service_error_code="ThrottlingException",
+                        http_status_code=400,
+                    )
+                stubber.add_response("run_job_flow", {"JobFlowId": f"j-{i}"}, config)
+
+            with patch("emr_launcher.aws.logger") as logger:
+                job_flow_ids = [
+                    emr_launch_cluster(config, emr_client)["JobFlowId"]
+                    for _ in range(30)
+                ]
+
+            stubber.assert_no_pending_responses()
+
+        assert job_flow_ids == [f"j-{i}" for i in range(30)]
+        # 45 calls at 5 per second with a burst of 10, slowed down by each throttle.
+        assert clock.now < 40
+        retried = [
+            c[1]["extra"]
+            for c in logger.log.call_args_list
+            if c[1]["extra"]["attempts"] > 1
+        ]
+        assert len(retried) == 15
+        assert all(extra["wait_seconds"] > 0 for extra in retried)
+
+    def test_rate_limited_without_throttling(self, clock):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+
+        with Stubber(emr_client) as stubber:
+            for _ in range(20):
+                stubber.add_response("add_tags", {})
+            for i in range(20):
+                emr_cluster_add_tags(f"j-{i}", {"Key": "Value"}, emr_client)
+
+        # The first 10 calls use the burst, the remaining 10 are paced at 5 per second.
+        assert clock.now == pytest.approx(2.0)
+
+    def test_gives_up_after_max_attempts(self, clock, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_EMR_MAX_ATTEMPTS", "3")
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+
+        with Stubber(emr_client) as stubber:
+            for _ in range(3):
+                stubber.add_client_error(
+                    "describe_security_configuration",
+                    service_error_code="ThrottlingException",
+                    http_status_code=400,
+                )
+            with pytest.raises(ClientError):
+                dup_security_configuration("source", emr_client)
+            stubber.assert_no_pending_responses()
+
+    def test_other_errors_are_not_retried(self, clock):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+
+        with Stubber(emr_client) as stubber:
+            stubber.add_client_error(
+                "describe_security_configuration",
+                service_error_code="InvalidRequestException",
+                http_status_code=400,
+            )
+            with pytest.raises(ClientError):
+                dup_security_configuration("source", emr_client)
+            stubber.assert_no_pending_responses()
+
+    def test_transient_errors_are_retried(self, clock):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        limiter = _get_rate_limiter("add_tags")
+        rate = limiter.rate
+
+        with Stubber(emr_client) as stubber:
+            stubber.add_client_error(
+                "add_tags",
+                service_error_code="InternalServerError",
+                http_status_code=500,
+            )
+            stubber.add_response("add_tags", {})
+            emr_cluster_add_tags("j-TEST", {"Key": "Value"}, emr_client)
+            stubber.assert_no_pending_responses()
+
+        assert limiter.rate == rate
+
+    def test_connection_errors_are_retried(self, clock):
+        emr_client = MagicMock()
+        emr_client.add_tags.side_effect = [
+            EndpointConnectionError(endpoint_url="https://emr"),
+            {},
+        ]
+
+        emr_cluster_add_tags("j-TEST", {"Key": "Value"}, emr_client)
+
+        assert emr_client.add_tags.call_count == 2
+
+
+class TestSecurityConfigurations:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        SECURITY_CONFIGS_CACHE.invalidate()
+        yield
+        SECURITY_CONFIGS_CACHE.invalidate()
+
+    @mock_emr
+    def test_dup_security_configuration_reuses_same_content(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        emr_client.create_security_configuration(
+            Name="source", SecurityConfiguration='{"EncryptionConfiguration": {}}'
+        )
+
+        first = dup_security_configuration("source", emr_client)
+        SECURITY_CONFIGS_CACHE.invalidate()
+        second = dup_security_configuration("source", emr_client)
+
+        assert (
+            first
+            == second
+            == security_configuration_duplicate_name(
+                "source", '{"EncryptionConfiguration": {}}'
+            )
+        )
+        assert (
+            emr_client.describe_security_configuration(Name=first)[
+                "SecurityConfiguration"
+            ]
+            == '{"EncryptionConfiguration": {}}'
+        )
+
+    @mock_emr
+    def test_dup_security_configuration_cached(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        emr_client.create_security_configuration(
+            Name="source", SecurityConfiguration="{}"
+        )
+        first = dup_security_configuration("source", emr_client)
+
+        with Stubber(emr_client) as stubber:
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": "source", "SecurityConfiguration": "{}"},
+                {"Name": "source"},
+            )
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": first, "SecurityConfiguration": "{}"},
+                {"Name": first},
+            )
+            assert dup_security_configuration("source", emr_client) == first
+            stubber.assert_no_pending_responses()
+
+    @mock_emr
+    def test_dup_security_configuration_copies_edited_source(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        emr_client.create_security_configuration(
+            Name="source", SecurityConfiguration='{"a": 1}'
+        )
+        first = dup_security_configuration("source", emr_client)
+
+        emr_client.delete_security_configuration(Name="source")
+        emr_client.create_security_configuration(
+            Name="source", SecurityConfiguration='{"b": 2}'
+        )
+        second = dup_security_configuration("source", emr_client)
+
+        assert second == security_configuration_duplicate_name("source", '{"b": 2}')
+        assert second != first
+        assert (
+            emr_client.describe_security_configuration(Name=second)[
+                "SecurityConfiguration"
+            ]
+            == '{"b": 2}'
+        )
+
+    @mock_emr
+    def test_dup_security_configuration_recreates_deleted_copy(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        emr_client.create_security_configuration(
+            Name="source", SecurityConfiguration="{}"
+        )
+        first = dup_security_configuration("source", emr_client)
+
+        # A cleanup in another process deletes the copy, leaving this cache as it is.
+        emr_client.delete_security_configuration(Name=first)
+        second = dup_security_configuration("source", emr_client)
+        job_flow_id = emr_launch_cluster(
+            {
+                "Name": "test-cluster",
+                "ReleaseLabel": "emr-6.2.0",
+                "Instances": {"InstanceCount": 1, "MasterInstanceType": "m5.xlarge"},
+                "SecurityConfiguration": second,
+            },
+            emr_client,
+        )["JobFlowId"]
+
+        assert second == first
+        assert emr_client.describe_security_configuration(Name=second)
+        cluster = emr_client.describe_cluster(ClusterId=job_flow_id)["Cluster"]
+        assert cluster["SecurityConfiguration"] == second
+
+    def test_cleanup_security_configurations(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        old = datetime.now(timezone.utc) - timedelta(days=2)
+        recent = datetime.now(timezone.utc)
+        in_use = security_configuration_duplicate_name("source", '{"in": "use"}')
+        stale = security_configuration_duplicate_name("source", '{"a": 1}')
+
+        with Stubber(emr_client) as stubber:
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": "source", "SecurityConfiguration": '{"current": 1}'},
+                {"Name": "source"},
+            )
+            stubber.add_response(
+                "list_clusters",
+                {"Clusters": [{"Id": "j-1"}], "Marker": "page-2"},
+            )
+            stubber.add_response(
+                "describe_cluster",
+                {"Cluster": {"Id": "j-1", "SecurityConfiguration": in_use}},
+                {"ClusterId": "j-1"},
+            )
+            stubber.add_response("list_clusters", {"Clusters": []})
+            stubber.add_response(
+                "list_security_configurations",
+                {
+                    "SecurityConfigurations": [
+                        {"Name": "source", "CreationDateTime": old},
+                        {"Name": in_use, "CreationDateTime": old},
+                        {"Name": "source_20200101000000", "CreationDateTime": old},
+                    ],
+                    "Marker": "page-2",
+                },
+            )
+            stubber.add_response(
+                "list_security_configurations",
+                {
+                    "SecurityConfigurations": [
+                        {"Name": stale, "CreationDateTime": old},
+                        {"Name": "source_aaaaaaaaaaaaaaaa", "CreationDateTime": recent},
+                        {"Name": "source_0123456789abcdef", "CreationDateTime": old},
+                        {"Name": "other_bbbbbbbbbbbbbbbb", "CreationDateTime": old},
+                    ]
+                },
+                {"Marker": "page-2"},
+            )
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": stale, "SecurityConfiguration": '{"a": 1}'},
+                {"Name": stale},
+            )
+            # Named like a copy, but its content does not hash to its name.
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": "source_0123456789abcdef", "SecurityConfiguration": "{}"},
+                {"Name": "source_0123456789abcdef"},
+            )
+            for name in ["source_20200101000000", stale]:
+                stubber.add_response(
+                    "delete_security_configuration", {}, {"Name": name}
+                )
+
+            deleted = cleanup_security_configurations("source", emr_client=emr_client)
+            stubber.assert_no_pending_responses()
+
+        assert deleted == ["source_20200101000000", stale]
+
+    def test_cleanup_security_configurations_keeps_current_copy(self):
+        emr_client = boto3.client("emr", region_name="eu-west-2")
+        old = datetime.now(timezone.utc) - timedelta(days=2)
+        current = security_configuration_duplicate_name("source", '{"b": 2}')
+        previous = security_configuration_duplicate_name("source", '{"a": 1}')
+
+        with Stubber(emr_client) as stubber:
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": "source", "SecurityConfiguration": '{"b": 2}'},
+                {"Name": "source"},
+            )
+            stubber.add_response("list_clusters", {"Clusters": []})
+            stubber.add_response(
+                "list_security_configurations",
+                {
+                    "SecurityConfigurations": [
+                        {"Name": current, "CreationDateTime": old},
+                        {"Name": previous, "CreationDateTime": old},
+                    ]
+                },
+            )
+            stubber.add_response(
+                "describe_security_configuration",
+                {"Name": previous, "SecurityConfiguration": '{"a": 1}'},
+                {"Name": previous},
+            )
+            stubber.add_response(
+                "delete_security_configuration", {}, {"Name": previous}
+            )
+
+            deleted = cleanup_security_configurations("source", emr_client=emr_client)
+            stubber.assert_no_pending_responses()
+
+        assert deleted == [previous]
+
+    def test_cleanup_security_configurations_requires_source(self):
+        with pytest.raises(ValueError):
+            cleanup_security_configurations(None, emr_client=MagicMock())
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+from emr_launcher.cache import TTLCache
+
+
+class TestTTLCache:
+    def test_get_returns_fresh_value(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("key", "value")
+
+        assert cache.get("key") == "value"
+        assert cache.peek("key") == ("value", True)
+
+    def test_stale_value_kept_for_revalidation(self):
+        cache = TTLCache(max_size=2, ttl=10)
+        with patch("emr_launcher.cache.time.monotonic", return_value=100):
+            cache.set("key", "value")
+        with patch("emr_launcher.cache.time.monotonic", return_value=111):
+            assert cache.get("key") is None
+            assert cache.peek("key") == ("value", False)
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert len(cache) == 2
+
+    def test_invalidate(self):
+        cache = TTLCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        cache.invalidate("a")
+        assert "a" not in cache and "b" in cache
+
+        cache.invalidate()
+        assert len(cache) == 0
+
+    def test_zero_size_disables_cache(self):
+        cache = TTLCache(max_size=0)
+        cache.set("a", 1)
+
+        assert cache.get("a") is None
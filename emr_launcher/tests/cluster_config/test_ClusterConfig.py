@@ -5,8 +5,16 @@ import boto3
 from botocore.stub import Stubber
 from botocore.response import StreamingBody
 from io import BytesIO
-
-from emr_launcher.ClusterConfig import ClusterConfig, ConfigNotFoundError
+from unittest.mock import patch
+
+from emr_launcher.ClusterConfig import (
+    ClusterConfig,
+    ConfigNotFoundError,
+    S3_CONFIG_CACHE,
+    PARSE_CACHE,
+    yaml_loader,
+    parse_yaml,
+)
 
 TEST_PATH_CONFIG_CLUSTER = f"{os.path.dirname(__file__)}/test_cluster.yaml"
 TEST_PATH_CONFIG_INSTANCES = f"{os.path.dirname(__file__)}/test_instances.yaml"
@@ -20,7 +28,19 @@ def load_local_yaml(path):
         return yaml.safe_load(f.read())
 
 
+def streaming_body(content: str) -> StreamingBody:
+    stream = BytesIO(bytes(content, encoding="utf-8"))
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0, os.SEEK_SET)
+    return StreamingBody(stream, size)
+
+
 class TestConfig:
+    def setup_method(self):
+        S3_CONFIG_CACHE.invalidate()
+        S3_CONFIG_CACHE.ttl = 0
+
     def test_reads_local_config(self):
         actual = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_CLUSTER)
         expected = load_local_yaml(TEST_PATH_CONFIG_CLUSTER)
@@ -174,3 +194,253 @@ class TestConfig:
         config.override(overrides)
         assert config["Instances"]["Ec2SubnetId"] == "Test_Subnet_Id"
         assert config["Instances"]["EmrManagedMasterSecurityGroup"] == "$MASTER_SG"
+
+    def test_s3_config_revalidated_with_etag(self):
+        s3 = boto3.client("s3")
+        bucket = "config_bucket"
+        key = "config_key"
+
+        with open(TEST_PATH_CONFIG_CLUSTER, "r") as f:
+            config_content = f.read()
+
+        expected = yaml.safe_load(config_content)
+        with Stubber(s3) as stubber:
+            stubber.add_response(
+                "get_object",
+                {"Body": streaming_body(config_content), "ETag": '"etag-1"'},
+                {"Bucket": bucket, "Key": key},
+            )
+            stubber.add_client_error(
+                "get_object",
+                service_error_code="304",
+                http_status_code=304,
+                expected_params={
+                    "Bucket": bucket,
+                    "Key": key,
+                    "IfNoneMatch": '"etag-1"',
+                },
+            )
+            first = ClusterConfig.from_s3(bucket=bucket, key=key, s3_client=s3)
+            first["Name"] = "mutated"
+            second = ClusterConfig.from_s3(bucket=bucket, key=key, s3_client=s3)
+            stubber.assert_no_pending_responses()
+
+        assert second == expected
+        assert S3_CONFIG_CACHE.stats["revalidations"] >= 1
+
+    def test_s3_config_served_from_cache_within_ttl(self):
+        s3 = boto3.client("s3")
+        bucket = "config_bucket"
+        key = "config_key"
+        S3_CONFIG_CACHE.ttl = 300
+
+        with open(TEST_PATH_CONFIG_CLUSTER, "r") as f:
+            config_content = f.read()
+
+        with Stubber(s3) as stubber:
+            stubber.add_response(
+                "get_object",
+                {"Body": streaming_body(config_content), "ETag": '"etag-1"'},
+                {"Bucket": bucket, "Key": key},
+            )
+            first = ClusterConfig.from_s3(bucket=bucket, key=key, s3_client=s3)
+            second = ClusterConfig.from_s3(bucket=bucket, key=key, s3_client=s3)
+
+        assert first == second
+        assert first["Tags"] is not second["Tags"]
+
+    def test_s3_config_reloaded_when_changed(self):
+        s3 = boto3.client("s3")
+        bucket = "config_bucket"
+        key = "config_key"
+
+        with Stubber(s3) as stubber:
+            stubber.add_response(
+                "get_object",
+                {"Body": streaming_body("Name: old"), "ETag": '"etag-1"'},
+                {"Bucket": bucket, "Key": key},
+            )
+            stubber.add_response(
+                "get_object",
+                {"Body": streaming_body("Name: new"), "ETag": '"etag-2"'},
+                {"Bucket": bucket, "Key": key, "IfNoneMatch": '"etag-1"'},
+            )
+            ClusterConfig.from_s3(bucket=bucket, key=key, s3_client=s3)
+            actual = ClusterConfig.from_s3(bucket=bucket, key=key, s3_client=s3)
+
+        assert actual == {"Name": "new"}
+
+    def test_merge_tags(self):
+        config = ClusterConfig(
+            {
+                "Tags": [
+                    {"Key": "Owner", "Value": "old"},
+                    {"Key": "Name", "Value": "test"},
+                ]
+            }
+        )
+        config.merge_tags({"Owner": "new", "Correlation_Id": "test_correlation_id"})
+
+        assert config["Tags"] == [
+            {"Key": "Owner", "Value": "new"},
+            {"Key": "Name", "Value": "test"},
+            {"Key": "Correlation_Id", "Value": "test_correlation_id"},
+        ]
+
+    def test_merge_tags_without_existing_tags(self):
+        config = ClusterConfig({"Name": "test"})
+        config.merge_tags({"Correlation_Id": "test_correlation_id"})
+
+        assert config["Tags"] == [
+            {"Key": "Correlation_Id", "Value": "test_correlation_id"}
+        ]
+
+    def test_yaml_loader_prefers_libyaml(self):
+        expected = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        assert yaml_loader() is expected
+
+    def test_parse_yaml_matches_safe_load(self):
+        for path in [
+            TEST_PATH_CONFIG_CLUSTER,
+            TEST_PATH_CONFIG_INSTANCES,
+            TEST_PATH_CONFIG_CONFIGURATIONS,
+        ]:
+            with open(path, "r") as f:
+                content = f.read()
+            assert parse_yaml(content) == yaml.safe_load(content)
+
+    def test_parse_yaml_caches_identical_content(self):
+        PARSE_CACHE.invalidate()
+        with patch("yaml.load", wraps=yaml.load) as load:
+            first = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_INSTANCES)
+            second = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_INSTANCES)
+
+        assert load.call_count == 1
+        assert first == second
+        assert first["Instances"] is not second["Instances"]
+
+    def test_find_item(self):
+        config = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_CONFIGURATIONS)
+
+        actual = config.find_item("Configurations", "Classification", "yarn-site")
+
+        assert actual["Classification"] == "yarn-site"
+        assert config.find_item("Configurations", "Classification", "missing") is None
+        assert config.find_item("Nonexistent.Path", "Classification", "x") is None
+
+    def test_find_item_returns_first_match(self):
+        config = ClusterConfig(
+            {"Steps": [{"Name": "a", "Id": 1}, {"Name": "b"}, {"Name": "a", "Id": 2}]}
+        )
+
+        assert config.find_item("Steps", "Name", "a")["Id"] == 1
+
+    def test_find_item_index_invalidated_on_mutation(self):
+        config = ClusterConfig({"Steps": [{"Name": "a"}, {"Name": "b"}]})
+        assert config.find_item("Steps", "Name", "c") is None
+
+        config.extend_nested_list("Steps", [{"Name": "c"}])
+        assert config.find_item("Steps", "Name", "c") == {"Name": "c"}
+
+        config["Steps"] = [{"Name": "d"}]
+        assert config.find_item("Steps", "Name", "a") is None
+        assert config.find_item("Steps", "Name", "d") == {"Name": "d"}
+
+        config.find_replace("Steps", "Name", "d", lambda x: {"Name": "e"})
+        assert config.find_item("Steps", "Name", "e") == {"Name": "e"}
+
+    def test_find_item_index_invalidated_by_writable_node(self):
+        config = ClusterConfig({"Steps": [{"Name": "a"}, {"Name": "b"}]})
+        config.get_writable_node("Steps", 0)
+        assert config.find_item("Steps", "Name", "a") == {"Name": "a"}
+
+        config.get_writable_node("Steps", 0)["Name"] = "c"
+
+        assert config.find_item("Steps", "Name", "c") == {"Name": "c"}
+        assert config.find_item("Steps", "Name", "a") is None
+
+    def test_find_item_index_invalidated_by_merge_tags(self):
+        config = ClusterConfig({"Tags": [{"Key": "a", "Value": "1"}]})
+        assert config.find_item("Tags", "Key", "b") is None
+
+        config.merge_tags({"b": "2"})
+
+        assert config.find_item("Tags", "Key", "b") == {"Key": "b", "Value": "2"}
+
+    def test_find_item_detects_in_place_changes(self):
+        config = ClusterConfig({"Steps": [{"Name": "a"}, {"Name": "b"}]})
+        assert config.find_item("Steps", "Name", "a") == {"Name": "a"}
+
+        config["Steps"].reverse()
+
+        assert config.find_item("Steps", "Name", "a") is config["Steps"][1]
+
+    def test_find_replace_all(self):
+        config = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_CONFIGURATIONS)
+        config.find_replace_all(
+            "Configurations",
+            "Classification",
+            {
+                "yarn-site": lambda x: {**x, "Properties": {"yarn": "replaced"}},
+                "spark": lambda x: {**x, "Properties": {"spark": "replaced"}},
+            },
+        )
+
+        yarn_site = config.find_item("Configurations", "Classification", "yarn-site")
+        spark = config.find_item("Configurations", "Classification", "spark")
+        assert yarn_site["Properties"] == {"yarn": "replaced"}
+        assert spark["Properties"] == {"spark": "replaced"}
+
+    def test_find_replace_all_raises_not_list(self):
+        config = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_INSTANCES)
+
+        with pytest.raises(TypeError):
+            config.find_replace_all("Instances.Ec2SubnetId", "Name", {})
+
+    def test_derive_copies_only_mutated_paths(self):
+        base = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_INSTANCES)
+        expected = load_local_yaml(TEST_PATH_CONFIG_INSTANCES)
+
+        variant = base.derive()
+        variant.override({"Instances": {"Ec2SubnetId": "Test_Subnet_Id"}})
+        variant.extend_nested_list("Instances.InstanceFleets", [{"Name": "TEST"}])
+        variant.insert_nested_node("Instances.TestNode", {"TestKey": "TestValue"})
+        variant.find_replace(
+            "Instances.InstanceFleets", "Name", "MASTER", lambda x: {**x, "Name": "M"}
+        )
+
+        assert base == expected
+        assert variant["Instances"]["Ec2SubnetId"] == "Test_Subnet_Id"
+        assert variant["Instances"]["InstanceFleets"][0]["Name"] == "M"
+        assert variant["Instances"]["InstanceFleets"][-1] == {"Name": "TEST"}
+        assert (
+            variant["Instances"]["InstanceFleets"][1]
+            is base["Instances"]["InstanceFleets"][1]
+        )
+
+    def test_derive_protects_variants_from_base_changes(self):
+        base = ClusterConfig({"Steps": [{"Name": "a", "HadoopJarStep": {"Args": []}}]})
+        variant = base.derive()
+
+        base.get_writable_node("Steps", 0, "HadoopJarStep", "Args").append("--base")
+        variant.get_writable_node("Steps", 0, "HadoopJarStep", "Args").append("--event")
+
+        assert base["Steps"][0]["HadoopJarStep"]["Args"] == ["--base"]
+        assert variant["Steps"][0]["HadoopJarStep"]["Args"] == ["--event"]
+
+    def test_get_writable_node_copies_once(self):
+        shared = {"Steps": [{"Name": "a"}]}
+        config = ClusterConfig(shared)
+
+        first = config.get_writable_node("Steps", 0)
+        second = config.get_writable_node("Steps", 0)
+
+        assert first is second
+        assert first is not shared["Steps"][0]
+
+    def test_to_dict(self):
+        config = ClusterConfig.from_local(file_path=TEST_PATH_CONFIG_INSTANCES)
+        actual = config.to_dict()
+
+        assert type(actual) is dict
+        assert actual == load_local_yaml(TEST_PATH_CONFIG_INSTANCES)
@@ -0,0 +1,167 @@
+import os
+import shutil
+import time
+
+import pytest
+
+from botocore.exceptions import ParamValidationError
+from unittest.mock import patch, MagicMock
+
+from emr_launcher.handler import handler
+
+EMR_LAUNCHER_CONFIG_DIR = os.path.dirname(__file__)
+STUB_LATENCY = 0.2
+
+
+def slow_retrieve_secret(secret_name: str) -> str:
+    time.sleep(STUB_LATENCY)
+    return f"TEST_SECRET_{secret_name}"
+
+
+def slow_describe_security_configuration(name: str) -> str:
+    time.sleep(STUB_LATENCY)
+    return "{}"
+
+
+def dup_security_configuration(source_config: str, dry_run=False, content=None) -> str:
+    if content is None:
+        slow_describe_security_configuration(source_config)
+    return f"{source_config}_copy"
+
+
+def config_dir_with_security_configuration(tmp_path) -> str:
+    for config_type in ["cluster", "configurations", "instances", "steps"]:
+        shutil.copy(
+            os.path.join(EMR_LAUNCHER_CONFIG_DIR, f"{config_type}.yaml"), tmp_path
+        )
+    with open(tmp_path / "cluster.yaml", "a") as f:
+        f.write('SecurityConfiguration: "test_secconfig"\n')
+    return str(tmp_path)
+
+
+def timed_plan(payload: dict) -> tuple:
+    start = time.perf_counter()
+    response = handler({**payload, "plan": True})
+    return response, time.perf_counter() - start
+
+
+class TestAsyncLaunch:
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.dup_security_configuration")
+    def test_builds_same_config_as_sync(
+        self,
+        mock_dup_secconfig: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        mock_retrieve_secrets.side_effect = lambda name: f"TEST_SECRET_{name}"
+        mock_dup_secconfig.return_value = "test_secconfig_copy"
+        payload = {
+            "overrides": {
+                "Name": "Test_Name",
+                "SecurityConfiguration": "test_secconfig",
+            },
+            "extend": {"Tags": [{"Key": "Extra", "Value": "Tag"}]},
+            "copy_secconfig": True,
+        }
+
+        expected, _ = timed_plan(payload)
+        monkeypatch.setenv("EMR_LAUNCHER_ASYNC", "true")
+        actual, _ = timed_plan(payload)
+
+        assert actual["RunJobFlow"] == expected["RunJobFlow"]
+        assert actual["RunJobFlow"]["SecurityConfiguration"] == "test_secconfig_copy"
+        assert set(actual["timings_ms"]) == set(expected["timings_ms"])
+        mock_dup_secconfig.assert_called_with("test_secconfig", dry_run=True)
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.dup_security_configuration")
+    @patch("emr_launcher.handler.emr_describe_security_configuration")
+    def test_overlaps_secrets_and_security_configuration(
+        self,
+        mock_describe_secconfig: MagicMock,
+        mock_dup_secconfig: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+        tmp_path,
+    ):
+        monkeypatch.setenv(
+            "EMR_LAUNCHER_CONFIG_DIR", config_dir_with_security_configuration(tmp_path)
+        )
+        mock_retrieve_secrets.side_effect = slow_retrieve_secret
+        mock_describe_secconfig.side_effect = slow_describe_security_configuration
+        mock_dup_secconfig.side_effect = dup_security_configuration
+        payload = {"overrides": {"Name": "Test_Name"}, "copy_secconfig": True}
+
+        expected, sync_seconds = timed_plan(payload)
+        mock_dup_secconfig.reset_mock()
+        monkeypatch.setenv("EMR_LAUNCHER_ASYNC", "true")
+        actual, async_seconds = timed_plan(payload)
+
+        assert actual["RunJobFlow"] == expected["RunJobFlow"]
+        mock_describe_secconfig.assert_called_once_with("test_secconfig")
+        mock_dup_secconfig.assert_called_once_with(
+            "test_secconfig", dry_run=True, content="{}"
+        )
+        assert set(actual["timings_ms"]) == set(expected["timings_ms"])
+        # Sync waits for two secret lookups and the describe in turn, async for one.
+        assert sync_seconds >= 3 * STUB_LATENCY
+        assert async_seconds < 2 * STUB_LATENCY
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.dup_security_configuration")
+    @patch("emr_launcher.handler.emr_describe_security_configuration")
+    def test_copies_final_security_configuration_once(
+        self,
+        mock_describe_secconfig: MagicMock,
+        mock_dup_secconfig: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+        tmp_path,
+    ):
+        monkeypatch.setenv(
+            "EMR_LAUNCHER_CONFIG_DIR", config_dir_with_security_configuration(tmp_path)
+        )
+        monkeypatch.setenv("EMR_LAUNCHER_ASYNC", "true")
+        mock_retrieve_secrets.side_effect = lambda name: f"TEST_SECRET_{name}"
+        mock_describe_secconfig.return_value = "{}"
+        mock_dup_secconfig.side_effect = dup_security_configuration
+
+        actual, _ = timed_plan(
+            {
+                "overrides": {"SecurityConfiguration": "other_secconfig"},
+                "copy_secconfig": True,
+            }
+        )
+
+        assert actual["RunJobFlow"]["SecurityConfiguration"] == "other_secconfig_copy"
+        mock_dup_secconfig.assert_called_once_with("other_secconfig", dry_run=True)
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.dup_security_configuration")
+    @patch("emr_launcher.handler.emr_describe_security_configuration")
+    def test_invalid_config_copies_no_security_configuration(
+        self,
+        mock_describe_secconfig: MagicMock,
+        mock_dup_secconfig: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+        tmp_path,
+    ):
+        monkeypatch.setenv(
+            "EMR_LAUNCHER_CONFIG_DIR", config_dir_with_security_configuration(tmp_path)
+        )
+        monkeypatch.setenv("EMR_LAUNCHER_ASYNC", "true")
+        mock_retrieve_secrets.side_effect = lambda name: f"TEST_SECRET_{name}"
+        mock_describe_secconfig.return_value = "{}"
+
+        with pytest.raises(ParamValidationError):
+            handler(
+                {
+                    "overrides": {"Instances": {"InstanceCount": "many"}},
+                    "copy_secconfig": True,
+                }
+            )
+
+        mock_dup_secconfig.assert_not_called()
@@ -1,12 +1,18 @@
+import json
 import os
+import shutil
+import time
 import pytest
 import yaml
 
 from unittest.mock import patch, MagicMock, call
 from unittest import mock
+from botocore.exceptions import ParamValidationError
 
-from emr_launcher.handler import handler, get_event_time_as_date_string
+from emr_launcher.handler import handler, get_event_time_as_date_string, PIPELINE
 from emr_launcher.ClusterConfig import ClusterConfig
+from emr_launcher.logger import REDACTED
+from emr_launcher.util import read_configs
 
 EMR_LAUNCHER_CONFIG_DIR = os.path.dirname(__file__)
 
@@ -55,6 +61,28 @@ def mock_retrieve_secrets_side_effect(secret_name: str) -> str:
     return f"TEST_SECRET_{secret_name}"
 
 
+def s3_event_notification(message_id: str, s3_prefix: str) -> dict:
+    body = {
+        "Records": [
+            {
+                "eventTime": "2021-01-02T03:04:05.678Z",
+                "s3": {
+                    "bucket": {"name": "test_bucket"},
+                    "object": {"key": s3_prefix},
+                },
+            }
+        ]
+    }
+    return {"messageId": message_id, "body": json.dumps(body)}
+
+
+def launch_failing_message_2(config) -> dict:
+    tags = {tag["Key"]: tag["Value"] for tag in config["Tags"]}
+    if tags["Correlation_Id"] == "message_2":
+        raise RuntimeError("Launch failed")
+    return {"JobFlowId": f"j-{tags['Correlation_Id']}"}
+
+
 class TestE2E:
     @pytest.fixture(scope="session", autouse=True)
     def init_tests(self):
@@ -158,7 +186,10 @@ class TestE2E:
         mock_from_s3: MagicMock,
         mock_launch_cluster: MagicMock,
         mock_retrieve_secrets: MagicMock,
+        monkeypatch,
     ):
+        # The configs read from S3 are mocks, which are not valid RunJobFlow requests.
+        monkeypatch.setenv("EMR_LAUNCHER_VALIDATE_REQUEST", "false")
         if "EMR_LAUNCHER_CONFIG_DIR" in os.environ:
             del os.environ["EMR_LAUNCHER_CONFIG_DIR"]
 
@@ -187,7 +218,10 @@ class TestE2E:
         mock_from_s3: MagicMock,
         mock_launch_cluster: MagicMock,
         mock_retrieve_secrets: MagicMock,
+        monkeypatch,
     ):
+        # The configs read from S3 are mocks, which are not valid RunJobFlow requests.
+        monkeypatch.setenv("EMR_LAUNCHER_VALIDATE_REQUEST", "false")
         if "EMR_LAUNCHER_CONFIG_DIR" in os.environ:
             del os.environ["EMR_LAUNCHER_CONFIG_DIR"]
         os.environ["EMR_LAUNCHER_CONFIG_S3_FOLDER"] = "s3_folder"
@@ -205,6 +239,311 @@ class TestE2E:
         mock_launch_cluster.assert_called_once()
         mock_from_s3.assert_has_calls(calls, any_order=True)
 
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    @patch("emr_launcher.handler.emr_cluster_add_tags")
+    def test_s3_event_tags_applied_at_launch(
+        self,
+        mock_tag_cluster: MagicMock,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_launch_cluster.return_value = {"JobFlowId": "j-TEST"}
+
+        handler({"Records": [s3_event_notification("test_message_id", "test/prefix")]})
+
+        mock_launch_cluster.assert_called_once()
+        mock_tag_cluster.assert_not_called()
+        tags = mock_launch_cluster.call_args[0][0]["Tags"]
+        assert {"Key": "Correlation_Id", "Value": "test_message_id"} in tags
+        assert {"Key": "export_date", "Value": "2021-01-02"} in tags
+        assert len({tag["Key"] for tag in tags}) == len(tags)
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_sqs_batch_reports_failed_messages(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        monkeypatch.setenv("EMR_LAUNCHER_SQS_REPORT_BATCH_ITEM_FAILURES", "true")
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_launch_cluster.side_effect = launch_failing_message_2
+
+        actual = handler(
+            {
+                "Records": [
+                    s3_event_notification("message_1", "test/prefix_1"),
+                    s3_event_notification("message_2", "test/prefix_2"),
+                    s3_event_notification("message_3", "test/prefix_3"),
+                    {"messageId": "message_4", "body": json.dumps({"Records": [{}]})},
+                ]
+            }
+        )
+
+        assert actual == {
+            "batchItemFailures": [
+                {"itemIdentifier": "message_2"},
+                {"itemIdentifier": "message_4"},
+            ]
+        }
+        assert mock_launch_cluster.call_count == 3
+        for call_args in mock_launch_cluster.call_args_list:
+            config = call_args[0][0]
+            tags = {tag["Key"]: tag["Value"] for tag in config["Tags"]}
+            step_args = config["Steps"][0]["HadoopJarStep"]["Args"]
+            assert step_args[step_args.index("--correlation_id") + 1] == (
+                tags["Correlation_Id"]
+            )
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_sqs_batch_raises_failure_unless_reporting_enabled(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        monkeypatch.delenv("EMR_LAUNCHER_SQS_REPORT_BATCH_ITEM_FAILURES", raising=False)
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_launch_cluster.side_effect = launch_failing_message_2
+
+        with pytest.raises(RuntimeError, match="Launch failed"):
+            handler(
+                {
+                    "Records": [
+                        s3_event_notification("message_1", "test/prefix_1"),
+                        s3_event_notification("message_2", "test/prefix_2"),
+                    ]
+                }
+            )
+        assert mock_launch_cluster.call_count == 2
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_redelivered_message_does_not_launch_again(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+        tmp_path,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        monkeypatch.setenv("EMR_LAUNCHER_IDEMPOTENCY_STORE", "file")
+        monkeypatch.setenv("EMR_LAUNCHER_IDEMPOTENCY_DIR", str(tmp_path))
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_launch_cluster.return_value = {"JobFlowId": "j-TEST"}
+        event = {"Records": [s3_event_notification("message_1", "test/prefix")]}
+
+        assert handler(event) == {"batchItemFailures": []}
+        assert handler(event) == {"batchItemFailures": []}
+        mock_launch_cluster.assert_called_once()
+
+        direct_payload = {"overrides": {"Name": "Test_Name"}}
+        assert handler(direct_payload) == {"JobFlowId": "j-TEST"}
+        assert handler(direct_payload) == {"JobFlowId": "j-TEST"}
+        assert mock_launch_cluster.call_count == 2
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    @patch("emr_launcher.handler.dup_security_configuration")
+    def test_plan_returns_request_without_launching(
+        self,
+        mock_dup_secconfig: MagicMock,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_dup_secconfig.return_value = "test_secconfig_copy"
+        overrides = {"Name": "Test_Name", "SecurityConfiguration": "test_secconfig"}
+
+        actual = handler({"overrides": overrides, "copy_secconfig": True, "plan": True})
+
+        mock_launch_cluster.assert_not_called()
+        mock_dup_secconfig.assert_called_once_with("test_secconfig", dry_run=True)
+
+        expected = get_default_config()
+        expected.override(overrides)
+        expected["SecurityConfiguration"] = "test_secconfig_copy"
+        for item in expected["Configurations"]:
+            if item["Classification"] in ["spark-hive-site", "hive-site"]:
+                item["Properties"]["javax.jdo.option.ConnectionPassword"] = REDACTED
+        assert actual["plan"] is True
+        assert actual["RunJobFlow"] == expected
+        assert "TEST_SECRET" not in json.dumps(actual)
+        assert set(actual["timings_ms"]) == {
+            "config_load",
+            "secrets",
+            "overrides",
+            "validate",
+            "security_configuration",
+        }
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    @patch("emr_launcher.handler.emit_phase_metrics")
+    def test_emits_phase_metrics_when_enabled(
+        self,
+        mock_emit_metrics: MagicMock,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        monkeypatch.setenv("EMR_LAUNCHER_METRICS_ENABLED", "true")
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_launch_cluster.return_value = {"JobFlowId": "j-TEST"}
+
+        handler({"overrides": {"Name": "Test_Name"}})
+        handler({"Records": [s3_event_notification("test_message_id", "prefix")]})
+
+        direct_timer, direct_dimensions = mock_emit_metrics.call_args_list[0][0]
+        assert direct_dimensions == {"ConfigSource": "local", "EventType": "direct"}
+        assert set(direct_timer.timings) == {
+            "config_load",
+            "secrets",
+            "overrides",
+            "validate",
+            "run_job_flow",
+        }
+
+        s3_timer, s3_dimensions = mock_emit_metrics.call_args_list[1][0]
+        assert s3_dimensions == {"ConfigSource": "local", "EventType": "s3_event"}
+        assert set(s3_timer.timings) == {
+            "config_load",
+            "secrets",
+            "step_args",
+            "tagging",
+            "validate",
+            "run_job_flow",
+        }
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    @patch("emr_launcher.handler.dup_security_configuration")
+    def test_invalid_request_rejected_before_any_side_effects(
+        self,
+        mock_dup_secconfig: MagicMock,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+
+        with pytest.raises(ParamValidationError) as e:
+            handler(
+                {
+                    "overrides": {"EbsRootVolumeSize": "big", "Unknown": True},
+                    "extend": {"Steps": {"Name": "missing-jar-step"}},
+                    "copy_secconfig": True,
+                }
+            )
+
+        report = str(e.value)
+        assert "EbsRootVolumeSize" in report
+        assert "Unknown" in report
+        assert "HadoopJarStep" in report
+        mock_dup_secconfig.assert_not_called()
+        mock_launch_cluster.assert_not_called()
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_s3_events_share_memoized_base_config(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+        tmp_path,
+    ):
+        for config_type in ["cluster", "configurations", "instances", "steps"]:
+            shutil.copy(
+                os.path.join(EMR_LAUNCHER_CONFIG_DIR, f"{config_type}.yaml"), tmp_path
+            )
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", str(tmp_path))
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_launch_cluster.return_value = {"JobFlowId": "j-TEST"}
+
+        def launched_submit_job_args(message_id):
+            handler({"Records": [s3_event_notification(message_id, "prefix")]})
+            config = mock_launch_cluster.call_args[0][0]
+            return config.find_item("Steps", "Name", "submit-job")["HadoopJarStep"][
+                "Args"
+            ]
+
+        with patch(
+            "emr_launcher.handler.read_configs", wraps=read_configs
+        ) as mock_read_configs:
+            first = launched_submit_job_args("message_1")
+            second = launched_submit_job_args("message_2")
+            assert mock_read_configs.call_count == 1
+
+            os.utime(tmp_path / "steps.yaml", ns=(0, 0))
+            launched_submit_job_args("message_3")
+            assert mock_read_configs.call_count == 2
+
+            mock_retrieve_secrets.side_effect = lambda name: "ROTATED"
+            launched_submit_job_args("message_4")
+            assert mock_read_configs.call_count == 3
+
+        assert first[first.index("--correlation_id") + 1] == "message_1"
+        assert second[second.index("--correlation_id") + 1] == "message_2"
+        assert first.count("--correlation_id") == 1
+        assert second.count("--correlation_id") == 1
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_sqs_batch_builds_base_config_once(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+        tmp_path,
+    ):
+        for config_type in ["cluster", "configurations", "instances", "steps"]:
+            shutil.copy(
+                os.path.join(EMR_LAUNCHER_CONFIG_DIR, f"{config_type}.yaml"), tmp_path
+            )
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", str(tmp_path))
+        monkeypatch.setenv("EMR_LAUNCHER_SQS_BATCH_WORKERS", "4")
+        mock_retrieve_secrets.side_effect = mock_retrieve_secrets_side_effect
+        mock_launch_cluster.return_value = {"JobFlowId": "j-TEST"}
+        run_base = PIPELINE.run_base
+
+        def slow_run_base(*args, **kwargs):
+            # Keeps the build in flight until every message has missed the cache.
+            time.sleep(0.2)
+            return run_base(*args, **kwargs)
+
+        with patch.object(
+            PIPELINE, "run_base", side_effect=slow_run_base
+        ) as mock_run_base:
+            actual = handler(
+                {
+                    "Records": [
+                        s3_event_notification(f"batch_message_{i}", "prefix")
+                        for i in range(4)
+                    ]
+                }
+            )
+
+        assert actual == {"batchItemFailures": []}
+        mock_run_base.assert_called_once()
+        assert mock_launch_cluster.call_count == 4
+        correlation_ids = {
+            {tag["Key"]: tag["Value"] for tag in call[0][0]["Tags"]}["Correlation_Id"]
+            for call in mock_launch_cluster.call_args_list
+        }
+        assert correlation_ids == {f"batch_message_{i}" for i in range(4)}
+
     def test_get_event_time_as_date_string(
         self,
     ):
@@ -0,0 +1,147 @@
+import os
+
+from unittest.mock import patch, MagicMock
+
+from emr_launcher.handler import handler
+from emr_launcher.util import read_configs
+
+EMR_LAUNCHER_CONFIG_DIR = os.path.dirname(__file__)
+
+
+def launch_side_effect(cluster_config) -> dict:
+    tags = {tag["Key"]: tag["Value"] for tag in cluster_config["Tags"]}
+    if tags.get("export_date") == "2021-01-02":
+        raise RuntimeError("Launch failed")
+    return {"JobFlowId": f"j-{tags['export_date']}"}
+
+
+class TestFanOut:
+    @patch("emr_launcher.handler.read_configs", wraps=read_configs)
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_launches_each_variant_of_one_base_config(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        mock_read_configs: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        mock_retrieve_secrets.return_value = "TEST_SECRET"
+        mock_launch_cluster.side_effect = launch_side_effect
+
+        actual = handler(
+            {
+                "overrides": {"Name": "Test_Name"},
+                "fan_out": [
+                    {"export_date": "2021-01-01", "s3_prefix": "prefix/1"},
+                    {"export_date": "2021-01-02", "s3_prefix": "prefix/2"},
+                    {
+                        "export_date": "2021-01-03",
+                        "s3_prefix": "prefix/3",
+                        "overrides": {"Name": "Other_Name"},
+                    },
+                ],
+            }
+        )
+
+        assert actual["JobFlowIds"] == ["j-2021-01-01", "j-2021-01-03"]
+        assert actual["Launches"][1] == {
+            "Error": "Launch failed",
+            "ErrorType": "RuntimeError",
+        }
+        mock_read_configs.assert_called_once()
+        assert mock_retrieve_secrets.call_count == 2
+
+        configs = {
+            call[0][0]["Tags"][-1]["Value"]: call[0][0]
+            for call in mock_launch_cluster.call_args_list
+        }
+        assert configs["2021-01-01"]["Name"] == "Test_Name"
+        assert configs["2021-01-03"]["Name"] == "Other_Name"
+        for step in configs["2021-01-03"]["Steps"]:
+            if "HadoopJarStep" in step:
+                assert step["HadoopJarStep"]["Args"][-4:] == [
+                    "--s3_prefix",
+                    "prefix/3",
+                    "--export_date",
+                    "2021-01-03",
+                ]
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_invalid_parameter_set_fails_alone(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        mock_retrieve_secrets.return_value = "TEST_SECRET"
+        mock_launch_cluster.return_value = {"JobFlowId": "j-TEST"}
+
+        actual = handler(
+            {"fan_out": [{"export_date": "2021-01-01"}, {"unknown_field": "value"}]}
+        )
+
+        assert actual["JobFlowIds"] == ["j-TEST"]
+        assert actual["Launches"][1]["ErrorType"] == "TypeError"
+        mock_launch_cluster.assert_called_once()
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    def test_retry_only_launches_failed_variants(
+        self,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        monkeypatch.setenv("EMR_LAUNCHER_IDEMPOTENCY_STORE", "memory")
+        mock_retrieve_secrets.return_value = "TEST_SECRET"
+        mock_launch_cluster.side_effect = launch_side_effect
+        payload = {
+            "overrides": {"Name": "Fan_Out_Retry"},
+            "fan_out": [{"export_date": "2021-01-01"}, {"export_date": "2021-01-02"}],
+        }
+
+        handler(payload)
+        mock_launch_cluster.reset_mock()
+        actual = handler(payload)
+
+        assert actual["JobFlowIds"] == ["j-2021-01-01"]
+        mock_launch_cluster.assert_called_once()
+
+    @patch("emr_launcher.handler.sm_retrieve_secrets")
+    @patch("emr_launcher.handler.emr_launch_cluster")
+    @patch("emr_launcher.handler.emit_phase_metrics")
+    def test_times_each_variant_separately(
+        self,
+        mock_emit_metrics: MagicMock,
+        mock_launch_cluster: MagicMock,
+        mock_retrieve_secrets: MagicMock,
+        monkeypatch,
+    ):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", EMR_LAUNCHER_CONFIG_DIR)
+        monkeypatch.setenv("EMR_LAUNCHER_METRICS_ENABLED", "true")
+        mock_retrieve_secrets.return_value = "TEST_SECRET"
+        mock_launch_cluster.return_value = {"JobFlowId": "j-TEST"}
+
+        handler(
+            {
+                "fan_out": [
+                    {"export_date": "2021-01-01", "correlation_id": "timed-1"},
+                    {"export_date": "2021-01-02", "correlation_id": "timed-2"},
+                ]
+            }
+        )
+
+        emitted = [
+            (call[0][1]["EventType"], set(call[0][0].timings))
+            for call in mock_emit_metrics.call_args_list
+        ]
+        assert emitted[0] == ("fan_out", {"config_load", "secrets"})
+        assert len(emitted) == 3
+        for event_type, phases in emitted[1:]:
+            assert event_type == "fan_out_variant"
+            assert phases == {"step_args", "tagging", "validate", "run_job_flow"}
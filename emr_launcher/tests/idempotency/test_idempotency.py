@@ -0,0 +1,101 @@
+import boto3
+import pytest
+
+from unittest.mock import MagicMock
+from moto import mock_dynamodb
+
+from emr_launcher.idempotency import (
+    MemoryStore,
+    FileStore,
+    DynamoDBStore,
+    LaunchInProgressError,
+    idempotent_launch,
+    payload_key,
+)
+
+RESPONSE = {"JobFlowId": "j-TEST", "ClusterArn": "arn:j-TEST", "ResponseMetadata": {}}
+
+
+@pytest.fixture
+def dynamodb_store():
+    with mock_dynamodb():
+        client = boto3.client("dynamodb", region_name="eu-west-2")
+        client.create_table(
+            TableName="emr-launcher-idempotency",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield DynamoDBStore("emr-launcher-idempotency", client)
+
+
+@pytest.fixture(params=["memory", "file", "dynamodb"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStore()
+    if request.param == "file":
+        return FileStore(str(tmp_path))
+    return request.getfixturevalue("dynamodb_store")
+
+
+class TestIdempotency:
+    def test_repeat_returns_original_job_flow_id(self, store):
+        launch = MagicMock(return_value=RESPONSE)
+
+        first = idempotent_launch("correlation_id:1", launch, store)
+        second = idempotent_launch("correlation_id:1", launch, store)
+
+        launch.assert_called_once()
+        assert first == RESPONSE
+        assert second == {"JobFlowId": "j-TEST", "ClusterArn": "arn:j-TEST"}
+
+    def test_different_keys_launch_separately(self, store):
+        launch = MagicMock(return_value=RESPONSE)
+
+        idempotent_launch("correlation_id:1", launch, store)
+        idempotent_launch("correlation_id:2", launch, store)
+
+        assert launch.call_count == 2
+
+    def test_failed_launch_is_released(self, store):
+        launch = MagicMock(side_effect=[RuntimeError("boom"), RESPONSE])
+
+        with pytest.raises(RuntimeError):
+            idempotent_launch("correlation_id:1", launch, store)
+        assert idempotent_launch("correlation_id:1", launch, store) == RESPONSE
+
+        assert launch.call_count == 2
+
+    def test_in_progress_launch_is_not_repeated(self, store, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_IDEMPOTENCY_WAIT", "0")
+        store.claim("correlation_id:1", 2**31)
+        launch = MagicMock(return_value=RESPONSE)
+
+        with pytest.raises(LaunchInProgressError):
+            idempotent_launch("correlation_id:1", launch, store)
+
+        launch.assert_not_called()
+
+    def test_expired_record_launches_again(self, store, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_IDEMPOTENCY_EXPIRY", "-10")
+        launch = MagicMock(return_value=RESPONSE)
+
+        idempotent_launch("correlation_id:1", launch, store)
+        idempotent_launch("correlation_id:1", launch, store)
+
+        assert launch.call_count == 2
+
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("EMR_LAUNCHER_IDEMPOTENCY_STORE", raising=False)
+        launch = MagicMock(return_value=RESPONSE)
+
+        idempotent_launch("correlation_id:1", launch)
+        idempotent_launch("correlation_id:1", launch)
+
+        assert launch.call_count == 2
+
+    def test_payload_key_ignores_key_order(self):
+        assert payload_key({"a": 1, "b": {"c": 2, "d": 3}}) == payload_key(
+            {"b": {"d": 3, "c": 2}, "a": 1}
+        )
+        assert payload_key({"a": 1}) != payload_key({"a": 2})
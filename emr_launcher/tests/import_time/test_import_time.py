@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+HEAVY_MODULES = ["boto3", "botocore", "yaml", "pythonjsonlogger", "asyncio"]
+IMPORT_TIME_THRESHOLD_MS = float(
+    os.getenv("EMR_LAUNCHER_IMPORT_TIME_THRESHOLD_MS", "150")
+)
+
+
+def measure_import(module: str) -> dict:
+    """
+    Imports `module` in a fresh interpreter with `-X importtime` and returns the cumulative
+    import time in microseconds of every module it loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+class TestImportTime:
+    def test_handler_import_does_not_load_heavy_dependencies(self):
+        timings = measure_import("emr_launcher.handler")
+
+        assert "emr_launcher.handler" in timings
+        for module in HEAVY_MODULES:
+            assert module not in timings, f"{module} is imported eagerly"
+
+    def test_handler_import_time_under_threshold(self):
+        best_ms = min(
+            measure_import("emr_launcher.handler")["emr_launcher.handler"] / 1000
+            for _ in range(3)
+        )
+
+        assert best_ms < IMPORT_TIME_THRESHOLD_MS, (
+            f"Importing emr_launcher.handler took {best_ms:.1f}ms, "
+            f"threshold is {IMPORT_TIME_THRESHOLD_MS}ms"
+        )
@@ -0,0 +1,86 @@
+import json
+import logging
+import logging.handlers
+
+from unittest.mock import patch
+
+from emr_launcher import logger as emr_logger
+from emr_launcher.logger import configure_log, flush_log, LogPayload, REDACTED
+
+
+def queue_handlers(logger):
+    return [h for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler)]
+
+
+class TestLogger:
+    def test_configure_log_is_idempotent(self):
+        for _ in range(100):
+            logger = configure_log()
+
+        assert len(queue_handlers(logger)) == 1
+        assert len(emr_logger._listener.handlers) == 1
+
+    def test_records_formatted_once_after_many_invocations(self):
+        for _ in range(50):
+            logger = configure_log()
+
+        formatter = emr_logger._listener.handlers[0].formatter
+        with patch.object(formatter, "format", wraps=formatter.format) as format:
+            for i in range(10):
+                logger.info("record %s", i)
+            flush_log()
+
+        assert format.call_count == 10
+
+    def test_configure_log_refreshes_level(self, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_LOG_LEVEL", "DEBUG")
+        assert configure_log().level == logging.DEBUG
+
+        monkeypatch.setenv("EMR_LAUNCHER_LOG_LEVEL", "INFO")
+        assert configure_log().level == logging.INFO
+
+    def test_message_arguments_resolved_before_queueing(self):
+        logger = configure_log()
+        args = {"key": "value"}
+
+        with patch.object(emr_logger._queue_handler, "enqueue") as enqueue:
+            logger.info("payload %s", args)
+            args["key"] = "changed"
+
+        record = enqueue.call_args[0][0]
+        assert record.msg == "payload {'key': 'value'}"
+        assert record.args is None
+
+    def test_log_payload_redacts_secrets(self):
+        payload = {
+            "Configurations": [
+                {
+                    "Classification": "hive-site",
+                    "Properties": {"javax.jdo.option.ConnectionPassword": "hunter2"},
+                }
+            ]
+        }
+
+        rendered = str(LogPayload(payload))
+
+        assert "hunter2" not in rendered
+        assert json.loads(rendered)["Configurations"][0]["Properties"] == {
+            "javax.jdo.option.ConnectionPassword": REDACTED
+        }
+
+    def test_log_payload_truncated(self):
+        payload = {"Steps": [{"Name": f"step-{i}"} for i in range(1000)]}
+
+        rendered = str(LogPayload(payload, max_chars=100))
+
+        assert rendered.startswith('{"Steps": [{"Name": "step-0"}')
+        assert rendered.endswith("...[truncated]")
+        assert len(rendered) == 100 + len("...[truncated]")
+
+    def test_log_payload_not_rendered_when_filtered(self):
+        logger = configure_log()
+
+        with patch("emr_launcher.logger._render_chunks") as render:
+            logger.debug("config %s", LogPayload({"Name": "test"}))
+
+        render.assert_not_called()
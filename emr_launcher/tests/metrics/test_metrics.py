@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+from emr_launcher.metrics import metrics_timer, emit_phase_metrics
+from emr_launcher.timing import PhaseTimer, NULL_TIMER
+
+
+class TestMetrics:
+    def test_metrics_timer_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("EMR_LAUNCHER_METRICS_ENABLED", raising=False)
+
+        timer = metrics_timer()
+        with timer.phase("config_load"):
+            pass
+
+        assert timer is NULL_TIMER
+        assert timer.timings == {}
+
+    def test_metrics_timer_enabled(self, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_METRICS_ENABLED", "true")
+
+        timer = metrics_timer()
+        with timer.phase("config_load"):
+            pass
+
+        assert isinstance(timer, PhaseTimer)
+        assert "config_load" in timer.timings
+
+    def test_emit_phase_metrics_embedded_metric_format(self, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_METRICS_NAMESPACE", "TestNamespace")
+        timer = PhaseTimer()
+        timer.timings = {"config_load": 12.5, "run_job_flow": 250.0}
+        dimensions = {"ConfigSource": "s3", "EventType": "s3_event"}
+
+        with patch("emr_launcher.metrics.logger") as logger:
+            emit_phase_metrics(timer, dimensions)
+
+        fields = logger.info.call_args[1]["extra"]
+        directive = fields["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Namespace"] == "TestNamespace"
+        assert directive["Dimensions"] == [["ConfigSource", "EventType"]]
+        assert directive["Metrics"] == [
+            {"Name": "config_load", "Unit": "Milliseconds"},
+            {"Name": "run_job_flow", "Unit": "Milliseconds"},
+        ]
+        assert fields["ConfigSource"] == "s3"
+        assert fields["EventType"] == "s3_event"
+        assert fields["config_load"] == 12.5
+        assert fields["run_job_flow"] == 250.0
+
+    def test_emit_phase_metrics_skips_empty_timer(self):
+        with patch("emr_launcher.metrics.logger") as logger:
+            emit_phase_metrics(NULL_TIMER, {"EventType": "direct"})
+
+        logger.info.assert_not_called()
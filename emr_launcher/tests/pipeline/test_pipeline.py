@@ -0,0 +1,56 @@
+from emr_launcher.ClusterConfig import ClusterConfig
+from emr_launcher.pipeline import Pipeline, LaunchContext
+from emr_launcher.timing import PhaseTimer
+
+
+def build_pipeline(calls):
+    pipeline = Pipeline()
+
+    @pipeline.stage("load", base=True)
+    def load(cluster_config, context):
+        calls.append("load")
+        return ClusterConfig({"Name": "cluster", "Tags": []})
+
+    @pipeline.stage("tagging", applies=lambda context: bool(context.tags))
+    def tagging(cluster_config, context):
+        calls.append("tagging")
+        cluster_config.merge_tags(context.tags)
+        return cluster_config
+
+    return pipeline
+
+
+class TestPipeline:
+    def test_run_times_applicable_stages_in_order(self):
+        calls = []
+        timer = PhaseTimer()
+
+        result = build_pipeline(calls).run(
+            LaunchContext(tags={"key": "value"}), timer=timer
+        )
+
+        assert calls == ["load", "tagging"]
+        assert list(timer.timings) == ["load", "tagging"]
+        assert result["Tags"] == [{"Key": "key", "Value": "value"}]
+
+    def test_run_skips_stages_that_do_not_apply(self):
+        calls = []
+        timer = PhaseTimer()
+
+        build_pipeline(calls).run(LaunchContext(), timer=timer)
+
+        assert calls == ["load"]
+        assert "tagging" not in timer.timings
+
+    def test_run_with_base_config_skips_base_stages(self):
+        calls = []
+        pipeline = build_pipeline(calls)
+        base_config = pipeline.run_base(LaunchContext())
+
+        first = pipeline.run(LaunchContext(tags={"a": "1"}), base_config.derive())
+        second = pipeline.run(LaunchContext(tags={"b": "2"}), base_config.derive())
+
+        assert calls == ["load", "tagging", "tagging"]
+        assert first["Tags"] == [{"Key": "a", "Value": "1"}]
+        assert second["Tags"] == [{"Key": "b", "Value": "2"}]
+        assert base_config["Tags"] == []
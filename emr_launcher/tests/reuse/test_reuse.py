@@ -0,0 +1,171 @@
+import boto3
+import pytest
+
+from moto import mock_emr
+
+from emr_launcher.aws import reset_clients, invalidate_waiting_clusters
+from emr_launcher.ClusterConfig import ClusterConfig
+from emr_launcher.handler import launch_cluster
+from emr_launcher.reuse import (
+    REUSE_COUNT_TAG,
+    FINGERPRINT_TAG,
+    find_reusable_cluster,
+    launch_fingerprint,
+)
+
+STEP = {
+    "Name": "submit-job",
+    "ActionOnFailure": "CONTINUE",
+    "HadoopJarStep": {"Jar": "command-runner.jar", "Args": ["spark-submit"]},
+}
+
+
+def cluster_config(**kwargs) -> ClusterConfig:
+    return ClusterConfig(
+        {
+            "Name": "test-cluster",
+            "ReleaseLabel": "emr-6.2.0",
+            "Instances": {
+                "InstanceCount": 1,
+                "MasterInstanceType": "m5.xlarge",
+                "KeepJobFlowAliveWhenNoSteps": True,
+            },
+            "Tags": [
+                {"Key": "Application", "Value": "test"},
+                {"Key": "Correlation_Id", "Value": "new"},
+            ],
+            "Steps": [STEP],
+            **kwargs,
+        }
+    )
+
+
+@pytest.fixture
+def emr_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    monkeypatch.setenv("EMR_LAUNCHER_REUSE_CLUSTERS", "true")
+    with mock_emr():
+        reset_clients()
+        invalidate_waiting_clusters()
+        yield boto3.client("emr", region_name="eu-west-2")
+    reset_clients()
+    invalidate_waiting_clusters()
+
+
+def running_cluster(emr_client, config: ClusterConfig, tags: list) -> str:
+    """Starts a WAITING cluster from `config`, tagged as a launch of it would be."""
+    params = {key: value for key, value in config.to_dict().items() if key != "Steps"}
+    tags = [*tags, {"Key": FINGERPRINT_TAG, "Value": launch_fingerprint(config)}]
+    return emr_client.run_job_flow(**{**params, "Tags": tags})["JobFlowId"]
+
+
+def cluster_tags(emr_client, job_flow_id: str) -> dict:
+    cluster = emr_client.describe_cluster(ClusterId=job_flow_id)["Cluster"]
+    return {tag["Key"]: tag["Value"] for tag in cluster["Tags"]}
+
+
+class TestReuse:
+    def test_submits_steps_to_matching_cluster(self, emr_client):
+        config = cluster_config()
+        job_flow_id = running_cluster(
+            emr_client,
+            config,
+            [
+                {"Key": "Application", "Value": "test"},
+                {"Key": "Correlation_Id", "Value": "old"},
+            ],
+        )
+
+        response = launch_cluster(config)
+
+        assert response["JobFlowId"] == job_flow_id
+        assert response["Reused"] is True
+        steps = emr_client.list_steps(ClusterId=job_flow_id)["Steps"]
+        assert [step["Id"] for step in steps] == response["StepIds"]
+        assert cluster_tags(emr_client, job_flow_id)[REUSE_COUNT_TAG] == "1"
+        assert cluster_tags(emr_client, job_flow_id)["Correlation_Id"] == "new"
+
+    def test_launches_when_tags_do_not_match(self, emr_client):
+        config = cluster_config()
+        job_flow_id = running_cluster(
+            emr_client, config, [{"Key": "Application", "Value": "other"}]
+        )
+
+        response = launch_cluster(config)
+
+        assert response["JobFlowId"] != job_flow_id
+        assert "Reused" not in response
+
+    def test_launches_when_cluster_shape_differs(self, emr_client):
+        config = cluster_config()
+        other = cluster_config(Applications=[{"Name": "Spark"}])
+        job_flow_id = running_cluster(
+            emr_client, other, [{"Key": "Application", "Value": "test"}]
+        )
+
+        response = launch_cluster(config)
+
+        assert response["JobFlowId"] != job_flow_id
+        launched_tags = cluster_tags(emr_client, response["JobFlowId"])
+        assert launched_tags[FINGERPRINT_TAG] == launch_fingerprint(config)
+
+    def test_cluster_without_fingerprint_is_not_reused(self, emr_client):
+        config = cluster_config()
+        params = {k: v for k, v in config.to_dict().items() if k != "Steps"}
+        job_flow_id = emr_client.run_job_flow(
+            **{**params, "Tags": [{"Key": "Application", "Value": "test"}]}
+        )["JobFlowId"]
+
+        assert launch_cluster(config)["JobFlowId"] != job_flow_id
+
+    def test_concurrent_launches_claim_different_clusters(self, emr_client):
+        config = cluster_config()
+        tags = [{"Key": "Application", "Value": "test"}]
+        job_flow_ids = {running_cluster(emr_client, config, tags) for _ in range(2)}
+
+        first = find_reusable_cluster(config)
+        second = find_reusable_cluster(config)
+
+        assert {first["Id"], second["Id"]} == job_flow_ids
+        assert find_reusable_cluster(config) is None
+
+    def test_launches_when_max_reuses_reached(self, emr_client, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_REUSE_MAX", "2")
+        config = cluster_config()
+        job_flow_id = running_cluster(
+            emr_client,
+            config,
+            [
+                {"Key": "Application", "Value": "test"},
+                {"Key": REUSE_COUNT_TAG, "Value": "2"},
+            ],
+        )
+
+        response = launch_cluster(config)
+
+        assert response["JobFlowId"] != job_flow_id
+        assert cluster_tags(emr_client, job_flow_id)[REUSE_COUNT_TAG] == "2"
+
+    def test_busy_cluster_is_not_reused(self, emr_client):
+        config = cluster_config()
+        job_flow_id = running_cluster(
+            emr_client, config, [{"Key": "Application", "Value": "test"}]
+        )
+
+        first = launch_cluster(config)
+        second = launch_cluster(config)
+
+        # Once its steps are submitted the cluster is RUNNING rather than WAITING.
+        assert first["JobFlowId"] == job_flow_id
+        assert second["JobFlowId"] != job_flow_id
+
+    def test_disabled_by_default(self, emr_client, monkeypatch):
+        monkeypatch.delenv("EMR_LAUNCHER_REUSE_CLUSTERS")
+        config = cluster_config()
+        job_flow_id = running_cluster(
+            emr_client, config, [{"Key": "Application", "Value": "test"}]
+        )
+
+        assert launch_cluster(config)["JobFlowId"] != job_flow_id
@@ -0,0 +1,183 @@
+import os
+import shutil
+import boto3
+import pytest
+
+from unittest.mock import patch
+from moto import mock_s3
+
+from emr_launcher.aws import reset_clients, s3_get_object
+from emr_launcher.util import (
+    read_config,
+    read_configs,
+    add_command_line_params,
+    CONFIG_TYPES,
+    config_fingerprint,
+)
+from emr_launcher.ClusterConfig import (
+    ConfigNotFoundError,
+    S3_CONFIG_CACHE,
+    build_bundle,
+)
+
+E2E_CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "e2e")
+
+
+class TestUtil:
+    @pytest.fixture(autouse=True)
+    def local_config_dir(self, monkeypatch):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", E2E_CONFIG_DIR)
+
+    def test_read_configs_matches_serial_reads(self):
+        actual = read_configs()
+
+        assert list(actual.keys()) == [
+            "cluster",
+            "configurations",
+            "instances",
+            "steps",
+        ]
+        for config_type, config in actual.items():
+            assert config == read_config(config_type)
+
+    def test_read_configs_missing_optional_config(self, monkeypatch, tmp_path):
+        for config_type in ["cluster", "instances"]:
+            shutil.copy(os.path.join(E2E_CONFIG_DIR, f"{config_type}.yaml"), tmp_path)
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", str(tmp_path))
+
+        actual = read_configs(max_workers=2)
+
+        assert actual["configurations"] is None
+        assert actual["steps"] is None
+        assert actual["cluster"] == read_config("cluster")
+
+    def test_read_configs_missing_required_config(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_DIR", str(tmp_path))
+
+        with pytest.raises(ConfigNotFoundError):
+            read_configs()
+
+    def test_add_command_line_params(self):
+        cluster_config = {
+            "Steps": [
+                {"Name": "submit-job", "HadoopJarStep": {"Args": ["script.sh"]}},
+                {"Name": "create_pdm_trigger", "HadoopJarStep": {"Args": []}},
+                {"Name": "other", "HadoopJarStep": {"Args": []}},
+            ]
+        }
+
+        add_command_line_params(
+            cluster_config, "correlation", "prefix", "full", "2021-01-01", "true"
+        )
+
+        steps = cluster_config["Steps"]
+        assert steps[0]["HadoopJarStep"]["Args"] == [
+            "script.sh",
+            "--correlation_id",
+            "correlation",
+            "--s3_prefix",
+            "prefix",
+            "--snapshot_type",
+            "full",
+            "--export_date",
+            "2021-01-01",
+        ]
+        assert steps[1]["HadoopJarStep"]["Args"][-2:] == ["--skip_pdm_trigger", "true"]
+        assert steps[2]["HadoopJarStep"]["Args"] == []
+
+
+class TestBundle:
+    @pytest.fixture
+    def s3_client(self, monkeypatch):
+        monkeypatch.delenv("EMR_LAUNCHER_CONFIG_DIR", raising=False)
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_BUNDLE", "true")
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_S3_BUCKET", "test-bucket")
+        monkeypatch.setenv("EMR_LAUNCHER_CONFIG_S3_FOLDER", "configs")
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+        with mock_s3():
+            reset_clients()
+            S3_CONFIG_CACHE.invalidate()
+            s3_client = boto3.client("s3", region_name="eu-west-2")
+            s3_client.create_bucket(
+                Bucket="test-bucket",
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+            for config_type in CONFIG_TYPES:
+                with open(os.path.join(E2E_CONFIG_DIR, f"{config_type}.yaml")) as f:
+                    s3_client.put_object(
+                        Bucket="test-bucket",
+                        Key=f"configs/{config_type}.yaml",
+                        Body=f.read(),
+                    )
+            yield s3_client
+        reset_clients()
+        S3_CONFIG_CACHE.invalidate()
+
+    def test_build_bundle_is_deterministic(self):
+        assert build_bundle(E2E_CONFIG_DIR, CONFIG_TYPES) == build_bundle(
+            E2E_CONFIG_DIR, CONFIG_TYPES
+        )
+
+    def test_read_configs_from_bundle(self, s3_client):
+        expected = read_configs()
+        s3_client.put_object(
+            Bucket="test-bucket",
+            Key="configs/bundle.json.gz",
+            Body=build_bundle(E2E_CONFIG_DIR, CONFIG_TYPES),
+        )
+        S3_CONFIG_CACHE.invalidate()
+
+        with patch(
+            "emr_launcher.ClusterConfig.s3_get_object", wraps=s3_get_object
+        ) as mock_get_object:
+            actual = read_configs()
+
+        assert mock_get_object.call_count == 1
+        assert mock_get_object.call_args[0][:2] == (
+            "test-bucket",
+            "configs/bundle.json.gz",
+        )
+        assert list(actual.keys()) == CONFIG_TYPES
+        for config_type in CONFIG_TYPES:
+            assert actual[config_type] == expected[config_type]
+
+    def test_read_configs_bundle_missing_optional_config(self, s3_client, tmp_path):
+        for config_type in ["cluster", "instances"]:
+            shutil.copy(os.path.join(E2E_CONFIG_DIR, f"{config_type}.yaml"), tmp_path)
+        s3_client.put_object(
+            Bucket="test-bucket",
+            Key="configs/bundle.json.gz",
+            Body=build_bundle(str(tmp_path), CONFIG_TYPES),
+        )
+
+        actual = read_configs()
+
+        assert actual["configurations"] is None
+        assert actual["steps"] is None
+        assert actual["cluster"]["Name"] == "emr-launcher-test"
+
+    def test_read_configs_falls_back_without_bundle(self, s3_client):
+        actual = read_configs()
+
+        assert list(actual.keys()) == CONFIG_TYPES
+        assert actual["cluster"]["Name"] == "emr-launcher-test"
+        assert actual["steps"]["Steps"][0]["Name"] == "emr-setup"
+
+    def test_config_fingerprint_follows_s3_etags(self, s3_client):
+        location, fingerprint = config_fingerprint()
+        assert location == ("s3", "test-bucket", "configs")
+        assert config_fingerprint() == (location, fingerprint)
+
+        s3_client.put_object(
+            Bucket="test-bucket", Key="configs/steps.yaml", Body="Steps: []"
+        )
+        assert config_fingerprint()[1] != fingerprint
+
+        s3_client.put_object(
+            Bucket="test-bucket",
+            Key="configs/bundle.json.gz",
+            Body=build_bundle(E2E_CONFIG_DIR, CONFIG_TYPES),
+        )
+        assert [key for key, _ in config_fingerprint()[1]] == ["bundle.json.gz"]
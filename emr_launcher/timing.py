@@ -0,0 +1,40 @@
+import time
+
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """Records the wall-clock duration of named phases of a launch, in milliseconds."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.timings[name] = self.timings.get(name, 0) + elapsed_ms
+
+
+class _NullPhase:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullTimer:
+    """A PhaseTimer that records nothing, used when no timings were asked for."""
+
+    timings = {}
+    _phase = _NullPhase()
+
+    def phase(self, name: str):
+        return self._phase
+
+
+NULL_TIMER = NullTimer()
@@ -5,13 +5,25 @@ import logging
 import os
 import json
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
-from emr_launcher.logger import configure_log
-from emr_launcher.ClusterConfig import ClusterConfig, ConfigNotFoundError
+from emr_launcher.logger import configure_log, LogPayload
+from emr_launcher.ClusterConfig import (
+    ClusterConfig,
+    ConfigNotFoundError,
+    BUNDLE_KEY,
+    load_s3_bundle,
+    parse_bundle,
+    s3_config_etag,
+)
 
 NAME_KEY = "Name"
 
+CONFIG_TYPES = ["cluster", "configurations", "instances", "steps"]
+OPTIONAL_CONFIG_TYPES = ["configurations", "steps"]
+DEFAULT_CONFIG_READ_WORKERS = 4
+
 
 def deprecated(func):
     """This is a decorator which can be used to mark functions
@@ -32,6 +44,11 @@ def deprecated(func):
     return new_func
 
 
+def get_config_source() -> str:
+    """Returns `local` when configs are read from EMR_LAUNCHER_CONFIG_DIR, otherwise `s3`."""
+    return "local" if os.getenv("EMR_LAUNCHER_CONFIG_DIR") else "s3"
+
+
 def get_s3_location(s3_overrides):
     if s3_overrides is None:
         return (
@@ -89,7 +106,7 @@ def read_config(
             s3_key = f"{s3_folder}/{config_type}.yaml"
             config = ClusterConfig.from_s3(bucket=s3_bucket, key=s3_key)
 
-        logger.debug(f"{config_type} config:", config)
+        logger.debug("%s config: %s", config_type, LogPayload(config))
 
         return config
     except ConfigNotFoundError:
@@ -99,6 +116,149 @@ def read_config(
             logger.debug(f"Config type {config_type} not found")
 
 
+def read_configs(
+    config_types: list = None, s3_overrides: dict = None, max_workers: int = None
+) -> dict:
+    """Reads several EMR cluster configuration files concurrently.
+
+    Each file is fetched and parsed by `read_config` on a bounded thread pool, so the
+    S3 round trips overlap instead of running one after another.
+
+    Parameters:
+    config_types (list): The config types to read, defaults to all of `CONFIG_TYPES`.
+                         Types in `OPTIONAL_CONFIG_TYPES` are read with `required=False`.
+
+    s3_overrides (dict): The optional s3 location overrides for the EMR config files
+
+    max_workers (int): Upper bound on concurrent reads, defaults to the
+                       `EMR_LAUNCHER_CONFIG_READ_WORKERS` environment variable
+    Returns:
+    dict: The result of `read_config` for each config type, in the order requested.
+    """
+    if config_types is None:
+        config_types = CONFIG_TYPES
+
+    if bundle_enabled() and not os.getenv("EMR_LAUNCHER_CONFIG_DIR"):
+        configs = read_bundle(config_types, s3_overrides)
+        if configs is not None:
+            return configs
+
+    if max_workers is None:
+        max_workers = int(
+            os.getenv("EMR_LAUNCHER_CONFIG_READ_WORKERS", DEFAULT_CONFIG_READ_WORKERS)
+        )
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(config_types)))
+    ) as executor:
+        futures = {
+            config_type: executor.submit(
+                read_config,
+                config_type,
+                s3_overrides,
+                config_type not in OPTIONAL_CONFIG_TYPES,
+            )
+            for config_type in config_types
+        }
+        return {config_type: future.result() for config_type, future in futures.items()}
+
+
+def bundle_enabled() -> bool:
+    return os.getenv("EMR_LAUNCHER_CONFIG_BUNDLE", "false").lower() == "true"
+
+
+def read_bundle(config_types: list, s3_overrides: dict = None):
+    """Reads EMR cluster configuration files from the bundle object in S3.
+
+    Parameters:
+    config_types (list): The config types to return. Types in `OPTIONAL_CONFIG_TYPES`
+                         that are not in the bundle are returned as None.
+
+    s3_overrides (dict): The optional s3 location overrides for the EMR config files
+    Returns:
+    dict: A ClusterConfig for each config type, in the order requested, or None if there
+          is no bundle, in which case the individual files should be read instead.
+    """
+    logger = logging.getLogger("emr_launcher")
+
+    s3_bucket, s3_folder = get_s3_location(s3_overrides)
+    s3_key = f"{s3_folder}/{BUNDLE_KEY}"
+    bundle = load_s3_bundle(bucket=s3_bucket, key=s3_key)
+    if bundle is None:
+        logger.info(
+            "Config bundle not found, reading individual files",
+            extra={"s3_bucket": s3_bucket, "s3_key": s3_key},
+        )
+        return None
+
+    configs = {}
+    for config_type in config_types:
+        if config_type in bundle:
+            configs[config_type] = ClusterConfig(bundle[config_type])
+        elif config_type in OPTIONAL_CONFIG_TYPES:
+            configs[config_type] = None
+        else:
+            raise ConfigNotFoundError(f"{config_type} is missing from {s3_key}")
+    return configs
+
+
+def config_fingerprint(config_types: list = None, s3_overrides: dict = None) -> tuple:
+    """Returns the location of the EMR cluster configuration files and their fingerprint.
+
+    The fingerprint changes whenever any of the files changes: it is made of the mtime and
+    size of each local file, or of the ETag of each S3 object (of the bundle alone when
+    one is used). Files that do not exist are included as None.
+
+    Parameters:
+    config_types (list): The config types to fingerprint, defaults to all of `CONFIG_TYPES`.
+
+    s3_overrides (dict): The optional s3 location overrides for the EMR config files
+    Returns:
+    tuple: A tuple of (location, fingerprint), both hashable.
+    """
+    if config_types is None:
+        config_types = CONFIG_TYPES
+
+    local_config_dir = os.getenv("EMR_LAUNCHER_CONFIG_DIR")
+    if local_config_dir:
+        fingerprint = []
+        for config_type in config_types:
+            try:
+                stat = os.stat(os.path.join(local_config_dir, f"{config_type}.yaml"))
+                fingerprint.append((config_type, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                fingerprint.append((config_type, None))
+        return ("local", local_config_dir), tuple(fingerprint)
+
+    s3_bucket, s3_folder = get_s3_location(s3_overrides)
+    location = ("s3", s3_bucket, s3_folder)
+    if bundle_enabled():
+        etag = s3_config_etag(
+            s3_bucket, f"{s3_folder}/{BUNDLE_KEY}", parse=parse_bundle, decode=False
+        )
+        if etag is not None:
+            return location, ((BUNDLE_KEY, etag),)
+
+    max_workers = int(
+        os.getenv("EMR_LAUNCHER_CONFIG_READ_WORKERS", DEFAULT_CONFIG_READ_WORKERS)
+    )
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(config_types)))
+    ) as executor:
+        futures = [
+            (
+                config_type,
+                executor.submit(
+                    s3_config_etag, s3_bucket, f"{s3_folder}/{config_type}.yaml"
+                ),
+            )
+            for config_type in config_types
+        ]
+        return location, tuple(
+            (config_type, future.result()) for config_type, future in futures
+        )
+
+
 def get_payload(event: dict):
     if event is None:
         return {}
@@ -116,6 +276,21 @@ class Payload:
     extend: dict = None
     additional_step_args: dict = None
     copy_secconfig: bool = False
+    plan: bool = False
+    fan_out: list = None
+
+
+@dataclass
+class FanOutParameters:
+    """One parameter set of a fan-out launch, see `launch_fan_out` in the handler."""
+
+    correlation_id: str = None
+    s3_bucket_name: str = None
+    s3_prefix: str = None
+    export_date: str = None
+    overrides: dict = None
+    extend: dict = None
+    additional_step_args: dict = None
 
 
 STEPS = "Steps"
@@ -152,6 +327,12 @@ def add_command_line_params(
     """
     logger = configure_log()
 
+    config = (
+        cluster_config
+        if isinstance(cluster_config, ClusterConfig)
+        else ClusterConfig(cluster_config)
+    )
+
     try:
         for step_name in [
             SEND_NOTIFICATION_STEP,
@@ -163,7 +344,7 @@ def add_command_line_params(
             SOURCE,
         ]:
             add_command_line_args_to_step(
-                cluster_config,
+                config,
                 correlation_id,
                 s3_prefix,
                 snapshot_type,
@@ -172,7 +353,7 @@ def add_command_line_params(
             )
 
         add_command_line_args_to_step(
-            cluster_config,
+            config,
             correlation_id,
             s3_prefix,
             snapshot_type,
@@ -184,6 +365,9 @@ def add_command_line_params(
         logger.error(ex)
         raise ex
 
+    if config is not cluster_config and config[STEPS] is not None:
+        cluster_config[STEPS] = config[STEPS]
+
 
 def add_command_line_args_to_step(
     cluster_config,
@@ -197,17 +381,15 @@ def add_command_line_args_to_step(
     """
     Adding command line arguments to an individual step.
     """
-    if (
-        next(
-            (sub for sub in cluster_config[STEPS] if sub[NAME_KEY] == step_name),
-            None,
-        )
-        is not None
-    ):
-        script_args = next(
-            (sub for sub in cluster_config[STEPS] if sub[NAME_KEY] == step_name),
-            None,
-        )[HADOOP_JAR_STEP][ARGS]
+    config = (
+        cluster_config
+        if isinstance(cluster_config, ClusterConfig)
+        else ClusterConfig(cluster_config)
+    )
+
+    position = config.index_of(STEPS, NAME_KEY, step_name)
+    if position is not None:
+        script_args = config.get_writable_node(STEPS, position, HADOOP_JAR_STEP, ARGS)
         script_args.append(CORRELATION_ID)
         script_args.append(correlation_id)
         script_args.append(S3_PREFIX)
@@ -221,7 +403,5 @@ def add_command_line_args_to_step(
             script_args.append(SKIP_PDM_TRIGGER_COMMAND)
             script_args.append(skip_pdm_trigger)
 
-        next(
-            (sub for sub in cluster_config[STEPS] if sub[NAME_KEY] == step_name),
-            None,
-        )[HADOOP_JAR_STEP][ARGS] = script_args
+    if config is not cluster_config and config[STEPS] is not None:
+        cluster_config[STEPS] = config[STEPS]